@@ -7,6 +7,7 @@ from collections import defaultdict, deque
 import pymunk
 from pymunk import Vec2d
 import gameobjects
+import pathfinding
 
 # NOTE: use only 'map0' during development!
 
@@ -36,20 +37,33 @@ class Ai:
     a breadth first search. Also capable of shooting other tanks and or wooden
     boxes. """
 
-    def __init__(self, tank, game_objects_list, tanks_list, space, currentmap):
+    def __init__(self, tank, game_objects_list, tanks_list, space, currentmap, path_finder=None, query_cache=None):
+        """ path_finder is the pathfinding.PathFinder shared by the Ai of a session, so that
+            the search towards a target is only done once. Each Ai gets its own if it is None.
+            query_cache is the spatial.QueryCache of the session, raycasts go straight to the
+            space if it is None. """
         self.tank = tank
         self.game_objects_list = game_objects_list
         self.tanks_list = tanks_list
         self.space = space
+        self.raycaster = query_cache if query_cache is not None else space
         self.currentmap = currentmap
+        self.path_finder = path_finder if path_finder is not None else pathfinding.PathFinder(currentmap)
         self.flag = None
         self.max_x = currentmap.width - 1
         self.max_y = currentmap.height - 1
         self.flag_start_position = self.currentmap.flag_position
         self.tank.ACCELERATION *= 1.3
         self.tank.NORMAL_MAX_SPEED *= 1.3
+        self.repairs = 0              # Number of paths repaired by the incremental planner, kept over respawns
+        self.repair_expansions = 0    # Number of tiles expanded by these repairs
+        self.reset()
 
+    def reset(self):
+        """ Forgets the current path and plan, call this when the tank has been put back on its
+            start position. The tank keeps the speed the Ai gave it in the constructor. """
         self.path = deque()
+        self.planner = None    # Incremental planner, created the first time the target moves away from our path
         self.move_cycle = self.move_cycle_gen()
         self.update_grid_pos()
 
@@ -83,7 +97,7 @@ class Ai:
         end = Vec2d(ray_x_end, ray_y_end)
         end = end + self.tank.body.position
 
-        ray = self.space.segment_query_first(start, end, 0, pymunk.ShapeFilter())
+        ray = self.raycaster.segment_query_first(start, end, 0, pymunk.ShapeFilter())
 
         # Try statement to catch Segments (outer bounds) not having a .shape
         try:
@@ -109,7 +123,7 @@ class Ai:
             if self.shortest_path:
 
                 if self.shortest_path[-1] != self.get_target_tile():
-                    self.shortest_path = self.find_shortest_path()
+                    self.shortest_path = self.repair_shortest_path()
 
                     if not self.shortest_path:
                         self.shortest_path = self.find_shortest_path(True)
@@ -222,54 +236,37 @@ class Ai:
         return current_angle, turn_to_angle
 
     def find_shortest_path(self, include_metal_box=False):
-        """ A simple Breadth First Search using integer coordinates as our nodes.
-            Edges are calculated as we go, using an external function.
+        """ Returns the shortest path from our tile to the target as a deque of tile centres.
+            The breadth first search is done from the target by the shared path finder,
+            which keeps the result for every Ai heading to the same tile.
         """
+        return self.path_finder.find_shortest_path(self.get_source_tile(), self.get_target_tile(), include_metal_box)
 
-        shortest_path = []  # Shortest path. List of Vec2d items
-        visited = set()     # Set of visited nodes
-        parents = {}        # Dictionary to store paths to different nodes
-        queue = deque()     # stores the different neighbors to a given node
-
-        source_node = self.get_source_tile()
-
-        queue.append(source_node)
-        visited.add(source_node)
-
-        while queue:
-            # Takes out the first node in queue
-            node = queue.popleft()
-
-            # Checks if the tank reach the flag position, otherwise continues the search
-            if node == self.get_target_tile():
-                shortest_path.append(node)
-
-                # Continues the search until it reaches the flag position
-                while node != source_node:
-                    node = parents[node]
-                    shortest_path.append(node)
-
-                # Reverses the path to find the shortest path from base to target
-                shortest_path.reverse()
-
-                break
-
-            # Goes through every neighbor to a given node and append it to the parent dictionary
-            for neighbor in self.get_tile_neighbors(node, include_metal_box):
-                if neighbor not in visited:
-
-                    queue.append(neighbor)
-                    visited.add(neighbor)
-                    parents[neighbor] = node
+    def repair_shortest_path(self):
+        """ Returns a new shortest path after the target has moved (for instance the flag carried
+            by another tank). Instead of searching from scratch, the incremental planner repairs
+            its previous search, which only expands the tiles affected by the moves.
+        """
+        source = self.get_tile_of_position(self.get_source_tile())
+        target = self.get_tile_of_position(self.get_target_tile())
 
-        return deque(shortest_path)
+        if self.planner is None:
+            self.planner = pathfinding.DStarLite(self.currentmap, source, target)
+        else:
+            self.planner.move_start(source)
+            self.planner.move_goal(target)
+        path = self.planner.find_path()
+        self.repairs += 1
+        self.repair_expansions += self.planner.expanded
+        return path
 
     def get_source_tile(self):
         """ Returns position of the flag if we have it. If we do not have the flag,
             returns the position of our home base"""
 
         if self.get_target_tile() == self.tank.start_position:
-            x, y = self.flag.x, self.flag.y
+            # A respawned tank can grab the flag before its first search, so make sure we know the flag
+            x, y = self.get_flag().x, self.get_flag().y
         else:
             x, y = self.tank.body.position
         return Vec2d(x // 1 + 0.5, y // 1 + 0.5)
@@ -309,29 +306,8 @@ class Ai:
             A bordering square is only considered accessible if it is grass
             or a wooden box.
         """
-
-        neighbors = []              # Find the coordinates of the tiles' four neighbors
-        available_neighbors = []    # Filter out the available neighbours a tank can get to
-
-        neighbors.append(coord_vec + Vec2d(0, 1))
-        neighbors.append(coord_vec + Vec2d(1, 0))
-        neighbors.append(coord_vec + Vec2d(0, -1))
-        neighbors.append(coord_vec + Vec2d(-1, 0))
-
-        width = self.currentmap.width
-        height = self.currentmap.height
-
-        # Appends to available_neighbours if a neighbour is accessible
-        for i in range(len(neighbors)):
-            x, y = neighbors[i][0], neighbors[i][1]
-
-            # Last statement is dependant on if we want to include metal boxes as accessible tiles or not
-            if (0 <= x <= width and 0 <= y <= height) and ((self.currentmap.boxAt(int(x // 1), int(y // 1)) in [0, 2])
-                                                           if not include_metal_box else
-                                                           (self.currentmap.boxAt(int(x // 1), int(y // 1)) in [0, 2, 3])):
-                available_neighbors.append(neighbors[i])
-
-        return available_neighbors
+        x, y = self.get_tile_of_position(coord_vec)
+        return [Vec2d(nx + 0.5, ny + 0.5) for nx, ny in pathfinding.tile_neighbors(self.currentmap, (x, y), include_metal_box)]
 
     def filter_tile_neighbors(self, coord):
         """ Used to filter the tile to check if it is a neighbor of the tank.
@@ -0,0 +1,188 @@
+""" Runs fixed scenarios on the bundled maps, without window or sound, and compares their
+    timings with a baseline to tell whether a change made the game faster or slower.
+"""
+import json
+import platform
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+
+import headless
+
+# Before pygame is imported, and before the game modules that load their images
+headless.init()
+
+import pygame
+import pymunk
+
+import maps
+import pathfinding
+from session import GameSession
+
+
+MAP_NAMES = ["map0", "map1", "map2"]
+
+# Metrics where a larger value is better, for every other metric a smaller value is
+HIGHER_IS_BETTER = {"ticks_per_sec"}
+
+
+def bench_ticks(current_map, ticks, repeats):
+    """ Simulates an AI-only match for ticks, repeats times, and returns the best number of ticks per
+        second and the average number of tiles expanded by a path repair of the incremental planners. """
+    best = None
+    for _ in range(repeats):
+        session = GameSession(current_map, human_players=0, headless=True)
+        elapsed = session.run(ticks)
+        best = elapsed if best is None else min(best, elapsed)
+    # The match is the same on every repeat, so the last one gives the expansions
+    repairs = sum(artificial_intelligence.repairs for artificial_intelligence in session.ai_list)
+    expansions = sum(artificial_intelligence.repair_expansions for artificial_intelligence in session.ai_list)
+    return {"ticks_per_sec": session.ticks / best, "repair_expansions": expansions / repairs if repairs else 0.0}
+
+
+def bench_paths(current_map, repeats):
+    """ Searches the shortest path between every pair of tiles a tank can drive on, with a path
+        finder that has no distance field yet. Returns the average time of a search. """
+    mask = maps.passable_mask()
+    tiles = [(x + 0.5, y + 0.5) for x, y in current_map.tiles_with(mask)]
+
+    best = None
+    for _ in range(repeats):
+        path_finder = pathfinding.PathFinder(current_map)
+        start_time = time.perf_counter()
+        for target in tiles:
+            for source in tiles:
+                path_finder.find_shortest_path(source, target)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return {"path_us": best / len(tiles) ** 2 * 1e6, "path_pairs": len(tiles) ** 2}
+
+
+def bench_render(current_map, frames, repeats, dirty_rects=False):
+    """ Draws frames frames of an AI-only match, one per tick, repeats times, and returns the
+        best median time of a frame in milliseconds. """
+    best = None
+    for _ in range(repeats):
+        session = GameSession(current_map, human_players=0, dirty_rects=dirty_rects)
+        surface = pygame.Surface(current_map.rect().size)
+        times = []
+        for _ in range(frames):
+            session.step()
+            start_time = time.perf_counter()
+            session.render(surface)
+            times.append(time.perf_counter() - start_time)
+        median = statistics.median(times)
+        best = median if best is None else min(best, median)
+    return best * 1000
+
+
+def bench_fog(current_map, frames, repeats):
+    """ Moves and draws the fog of war around the player while the Ai play, repeats times, and
+        returns the best median time of a frame in milliseconds. The player tank drives in
+        circles, so the fog moves every frame. """
+    best = None
+    for _ in range(repeats):
+        session = GameSession(current_map, human_players=1, play_FOW=True)
+        surface = pygame.Surface(current_map.rect().size)
+        session.tanks[0].accelerate()
+        session.tanks[0].turn_left()
+        times = []
+        for _ in range(frames):
+            session.step()
+            start_time = time.perf_counter()
+            session.update_fog()
+            session.fog.draw(surface)
+            times.append(time.perf_counter() - start_time)
+        median = statistics.median(times)
+        best = median if best is None else min(best, median)
+    return best * 1000
+
+
+def run_benchmarks(map_names, ticks, frames, repeats):
+    """ Returns the results of every scenario on every map as {map name: {metric: value}}. """
+    results = {}
+    for map_name in map_names:
+        current_map = maps.find(map_name)
+        result = {}
+        result.update(bench_ticks(current_map, ticks, repeats))
+        result.update(bench_paths(current_map, repeats))
+        result["render_ms"] = bench_render(current_map, frames, repeats)
+        result["render_dirty_ms"] = bench_render(current_map, frames, repeats, dirty_rects=True)
+        result["fog_ms"] = bench_fog(current_map, frames, repeats)
+        results[map_name] = result
+        print("%s: %s" % (map_name, ", ".join("%s %.4g" % item for item in result.items())), file=sys.stderr)
+    return results
+
+
+def environment():
+    """ Returns the versions the benchmarks ran with, timings of different setups are not comparable. """
+    return {"python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "pymunk": pymunk.version,
+            "machine": platform.machine(),
+            "system": platform.system()}
+
+
+def compare(results, baseline, tolerance, file=sys.stderr):
+    """ Prints every metric next to its baseline value to file and returns the metrics that got worse
+        by more than tolerance (a fraction of the baseline), as "map metric" strings. """
+    regressions = []
+    print("%-6s %-17s %12s %12s %8s" % ("map", "metric", "baseline", "now", "change"), file=file)
+    for map_name, result in results.items():
+        for metric, value in result.items():
+            old = baseline.get("results", {}).get(map_name, {}).get(metric)
+            if not old or metric == "path_pairs":
+                continue
+            change = value / old - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = "  slower" if worse > tolerance else ""
+            print("%-6s %-17s %12.4g %12.4g %+7.1f%%%s" % (map_name, metric, old, value, change * 100, flag), file=file)
+            if worse > tolerance:
+                regressions.append("%s %s" % (map_name, metric))
+    return regressions
+
+
+def main():
+    arg_parser = ArgumentParser(description="Times fixed scenarios on the bundled maps and compares them with a baseline")
+    arg_parser.add_argument("--maps", nargs="+", default=MAP_NAMES,
+                            help="maps to run the scenarios on: map0, map1, map2, maps of data/maps or paths of map files")
+    arg_parser.add_argument("--ticks", type=int, default=5000, help="ticks of the AI-only matches")
+    arg_parser.add_argument("--frames", type=int, default=500, help="frames drawn by the render and fog scenarios")
+    arg_parser.add_argument("--repeats", type=int, default=5,
+                            help="every scenario is run this many times and its best run is kept")
+    arg_parser.add_argument("--output", metavar="FILE", help="write the results to FILE as JSON instead of the standard output")
+    arg_parser.add_argument("--baseline", metavar="FILE", help="compare the results with the baseline in FILE")
+    arg_parser.add_argument("--write-baseline", metavar="FILE", help="store the results in FILE as the new baseline")
+    arg_parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="slowdown over the baseline, as a fraction, that counts as a regression")
+    args = arg_parser.parse_args()
+
+    report = {"environment": environment(),
+              "settings": {"ticks": args.ticks, "frames": args.frames, "repeats": args.repeats},
+              "results": run_benchmarks(args.maps, args.ticks, args.frames, args.repeats)}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("settings") != report["settings"] or baseline.get("environment") != report["environment"]:
+            print("warning: the baseline was measured with other settings or versions", file=sys.stderr)
+        regressions = compare(report["results"], baseline, args.tolerance)
+        if regressions:
+            print("slower than the baseline: %s" % ", ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
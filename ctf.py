@@ -1,18 +1,66 @@
 """ Main file for the game.
 """
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+
+def parse_arguments(argv=None):
+    """ Reads the command line options of the game """
+    arg_parser = ArgumentParser()
+
+    arg_parser.add_argument("--singleplayer", nargs="?", const=True, type=bool)
+    arg_parser.add_argument("--multiplayer", nargs="?", const=True, type=bool)
+    arg_parser.add_argument("--map", metavar="NAME",
+                            help="map to play on: map0, map1, map2, a map of data/maps or the path of a map file "
+                                 "(default map0, or the map a replay was recorded on)")
+    arg_parser.add_argument("--spectate", action="store_true",
+                            help="watch an AI-only match, the arrow keys move the camera and TAB follows the next tank")
+    arg_parser.add_argument("--headless", action="store_true",
+                            help="run an AI-only match without window, manual or sound, as fast as possible")
+    arg_parser.add_argument("--max-ticks", type=int, default=None,
+                            help="stop a headless match after this many ticks if nobody has won")
+    arg_parser.add_argument("--dirty-rects", action="store_true",
+                            help="only redraw and update the parts of the screen that changed")
+    arg_parser.add_argument("--merge-rocks", action="store_true",
+                            help="merge adjacent rock boxes into larger shapes in the physics engine")
+    arg_parser.add_argument("--tick-rate", type=int, default=None,
+                            help="number of simulation ticks per second, independent of the frame rate (default 50)")
+    arg_parser.add_argument("--record", metavar="FILE",
+                            help="record the commands of the players and the Ai into FILE")
+    arg_parser.add_argument("--replay", metavar="FILE",
+                            help="play a recorded match again, headless and as fast as possible")
+    arg_parser.add_argument("--seek", type=int, metavar="TICK", default=None,
+                            help="start the replay at TICK, from the closest keyframe before it")
+    arg_parser.add_argument("--trace", metavar="FILE",
+                            help="time the phases of every frame and write them to FILE as a Chrome trace")
+
+    return arg_parser.parse_args(argv)
+
+
+# The command line is only read when the game is started directly, a module importing ctf gets the defaults
+args = parse_arguments() if __name__ == "__main__" else parse_arguments([])
+
+# A replay is played headless
+if args.replay:
+    args.headless = True
+
+# Headless runs use the dummy drivers of SDL, they have to be selected before pygame is initialised
+if args.headless:
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
 import pygame
 from pygame.locals import *
 from pygame.color import *
-import pymunk
-from argparse import ArgumentParser
 import manual
+import profiler
+import replay
+import sounds
 
-manual.disp_manual("./data/Manual/welcome.png")
-manual.disp_manual("./data/Manual/instructions.png")
-manual.disp_manual("./data/Manual/information.png")
 
-
-# Calls pygame and pymunk to initialize the game. pygame handles visual ascepts and pymunk handles physics
+# Calls pygame to initialize the game. pygame handles visual ascepts, the physics (pymunk) belong to the session
 # ----- Initialisation ----- #
 
 # -- Initialise the display
@@ -22,71 +70,46 @@ pygame.display.set_mode()
 # -- Initialise the clock
 clock = pygame.time.Clock()
 
-# -- Initialise the physics engine
-space = pymunk.Space()
-space.gravity = (0.0, 0.0)
-space.damping = 0.1  # Adds friction to the ground for all objects
-
 # -- Import from the ctf framework
 # The framework needs to be imported after initialisation of pygame
-import ai
-import images
-import gameobjects
 import maps
+import viewport
+from session import GameSession
 
 
 # -- Constants
-FRAMERATE = 50
-frames_passed_since_shoot = 0
+FRAMERATE = GameSession.FRAMERATE
+MAX_WINDOW_SIZE = (1280, 720)  # A larger level is seen through a camera
 
 # -- Variables
 
 #   Define the current level
-current_map = maps.map0
-
-#   List of all game objects
-game_objects_list = []
-bases_list = []
-tanks_list = []
-bullet_list = []
-numbered_tanks = []
-ai_list = []
-explosion_list = []
-# Dictionary of all collision types
-collision_types = {
-    "bullet": 1,
-    "tank": 2,
-    "stone": 3,
-    "wood": 4,
-    "metal": 5,
-    "bounds": 6
-}
+try:
+    current_map = maps.find(args.map or "map0")
+except OSError as error:
+    # Most likely a misspelt name, the names that can be given are listed
+    sys.exit("Cannot load the map %s: %s\nThe maps are map0, map1, map2 and those of the library: %s"
+             % (args.map, error, ", ".join(maps.library()) or "none"))
+except ValueError as error:
+    sys.exit("Cannot load the map %s: %s" % (args.map, error))
 
 # Gamemodes
 play_FOW = False
 
-# Resize the screen to the size of the current level
-screen = pygame.display.set_mode(current_map.rect().size)
+# The timings of the phases of the frames are shown over the game, toggled with F3
+show_profile = False
 
-# Generate the background
-background = pygame.Surface(screen.get_size())
-
-# Create the flag
-flag = gameobjects.Flag(current_map.flag_position[0], current_map.flag_position[1])
-game_objects_list.append(flag)
+# The screen and the session depend on the level, they are created in setup_game()
+screen = None
+session = None
+camera = None  # viewport.Camera when the level does not fit in the window
 
 
 def single_or_multiplayer():
-    """ Handles hot-seat multiplayer. Returns 1 if singleplayer, 2 if multiplayer """
-    arg_parser = ArgumentParser()
-
-    arg_parser.add_argument("--singleplayer", nargs="?", const=True, type=bool)
-    arg_parser.add_argument("--multiplayer", nargs="?", const=True, type=bool)
-
-    args = arg_parser.parse_args()
-
-    if args.singleplayer:
-        play_type = 1
+    """ Handles hot-seat multiplayer. Returns 1 if singleplayer, 2 if multiplayer
+        and 0 in headless and spectator mode, where every tank is controlled by the Ai """
+    if args.headless or args.spectate:
+        play_type = 0
     elif args.multiplayer:
         play_type = 2
     else:
@@ -96,54 +119,7 @@ def single_or_multiplayer():
 
 
 # -- Functions
-def create_background():
-    """Copy the grass tile all over the level area"""
-    for x in range(0, current_map.width):
-        for y in range(0, current_map.height):
-            # The call to the function "blit" will copy the image
-            # contained in "images.grass" into the "background"
-            # image at the coordinates given as the second argument
-            background.blit(images.grass, (x * images.TILE_SIZE, y * images.TILE_SIZE))
-
-
-def create_boxes():
-    """Create the boxes"""
-    global game_objects_list
-    for x in range(0, current_map.width):
-        for y in range(0, current_map.height):
-            # Get the type of boxes
-            box_type = current_map.boxAt(x, y)
-            # If the box type is not 0 (aka grass tile), create a box
-            if (box_type != 0):
-                # Create a "Box" using the box_type, aswell as the x,y coordinates,
-                # and the pymunk space
-                box = gameobjects.get_box_with_type(x, y, box_type, space)
-                game_objects_list.append(box)
-
-
-def create_tanks():
-    """Create the tanks"""
-    global tanks_list, ai_list
-
-    # Loop over the starting poistion
-    for i in range(0, len(current_map.start_positions)):
-
-        # Get the starting position of the tank "i"
-        pos = current_map.start_positions[i]
-
-        if i < single_or_multiplayer():
-            # Create the tank, images.tanks contains the image representing the tank
-            tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[i], space)
-            tanks_list.append(tank)
-
-        else:
-            tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[i], space)
-            artificial_intelligence = ai.Ai(tank, game_objects_list, tanks_list, space, current_map)
-            ai_list.append(artificial_intelligence)
-            tanks_list.append(tank)
-
-
-def tank_shoot(event, tank, player):
+def tank_shoot(event, player):
     """Checks if player shoots """
 
     event_key = None
@@ -153,68 +129,53 @@ def tank_shoot(event, tank, player):
         event_key = K_SPACE
 
     if event.type == KEYDOWN and event.key == event_key:
-        for i in range(0, len(current_map.start_positions)):
-            if tank.frames_since_last_shoot > 50 and i == player:
-                bullet = tanks_list[i].shoot(space)
-                bullet_list.append(bullet)
-                tank.frames_since_last_shoot = 0
-
-
-def create_bases():
-    """Create the bases"""
-    global bases_list
+        session.player_shoot(player)
 
-    for i in range(0, len(current_map.start_positions)):
-        pos = current_map.start_positions[i]
-        base = gameobjects.GameVisibleObject(pos[0], pos[1], images.bases[i])
-        bases_list.append(base)
 
+def detect_exit(event):
+    """Check if we receive a QUIT event (for instance, if the user press the
+    close button of the window) or if the user press the escape key."""
 
-def create_bounds():
-    """Adds outer lines to prevent tanks from going out of bounds"""
-    global space
+    if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+        session.running = False
 
-    x_bound = current_map.width
-    y_bound = current_map.height
-    static_body = space.static_body
-    static_lines = [
-        pymunk.Segment(static_body, (0, 0), (0, y_bound), 0.0),
-        pymunk.Segment(static_body, (0, 0), (x_bound, 0), 0.0),
-        pymunk.Segment(static_body, (x_bound, y_bound), (0, y_bound), 0.0),
-        pymunk.Segment(static_body, (x_bound, y_bound), (x_bound, 0), 0.0),
-    ]
-    for line in static_lines:
-        line.collision_type = 6
-        line.elasticity = 0
-        line.friction = 1
 
-    space.add(*static_lines)
+def toggle_profile(event):
+    """Shows or hides the timings of the phases of the frames when F3 is pressed"""
+    global show_profile
 
+    if event.type == KEYDOWN and event.key == K_F3:
+        show_profile = not show_profile
+        # The phases are only timed while they are shown, or when a trace is written
+        session.profiler.enabled = show_profile or args.trace is not None
+        if not show_profile and session.dirty_renderer is not None:
+            session.dirty_renderer.full_redraw = True
 
-def create_explosion(bullet):
-    """creates an explosion"""
-    global explosion_list
 
-    exp = gameobjects.Explosion(bullet.x, bullet.y)
-    explosion_list.append(exp)
+def redraw_exposed(event):
+    """Draws everything on the next frame when the window system may have wiped the window"""
+    if event.type == VIDEOEXPOSE and session.dirty_renderer is not None:
+        session.dirty_renderer.full_redraw = True
 
-    # Creates an explosionsound
-    explosion_sound = pygame.mixer.Sound("./data/explosionsound.wav")
-    pygame.mixer.Sound.play(explosion_sound)
-    pygame.mixer.music.stop()
 
+def move_camera(event):
+    """Moves the camera of a spectator with the arrow keys, TAB follows the next tank and then moves freely again"""
+    keys = {K_LEFT: (-1, 0), K_RIGHT: (1, 0), K_UP: (0, -1), K_DOWN: (0, 1)}
 
-def detect_exit(event):
-    """Check if we receive a QUIT event (for instance, if the user press the
-    close button of the window) or if the user press the escape key."""
-    global running
-
-    if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
-        running = False
+    if event.type == KEYDOWN and event.key in keys:
+        camera.follow(None)
+        camera.scroll(*keys[event.key])
+    elif event.type == KEYUP and event.key in keys:
+        camera.scroll(0, 0)
+    elif event.type == KEYDOWN and event.key == K_TAB:
+        tanks = session.tanks
+        number = tanks.index(camera.target) + 1 if camera.target in tanks else 0
+        camera.follow(tanks[number] if number < len(tanks) else None)
 
 
 def move_tank(event, player):
     """Detects arrow key presses and moves tank"""
+    tanks_list = session.tanks_list
 
     if player == 0:
         if event.type == KEYDOWN and event.key == K_UP:
@@ -249,283 +210,159 @@ def move_tank(event, player):
             tanks_list[player].stop_turning()
 
 
-def ai_shoot(ai_tank, pos):
-    """ Shoot function for the Ai """
-    if ai_tank.tank.frames_since_last_shoot > 50:
-        if ai_tank.maybe_shoot(pos):
-            bullet = ai_tank.tank.shoot(space, True)
-            bullet_list.append(bullet)
-            ai_tank.tank.frames_since_last_shoot = 0
-
-
-def tank_destroyed():
-    """Checks if any tanks have been destroyed"""
-    global numbered_tanks, tanks_list, ai_list
-
-    for tank_num in range(0, len(current_map.start_positions)):
-        if tank_num not in numbered_tanks:
-
-            # Puts flag down
-            if flag.is_on_tank:
-                flag.is_on_tank = False
-
-            # Reset tanks to start position
-            numbered_tanks.insert(tank_num, tank_num)
-            pos = current_map.start_positions[tank_num]
-            tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[tank_num], space)
-            tanks_list.insert(tank_num, tank)
-
-            # tank_offset variable considers if we are playing single or multiplayer and adjusts the index accordingly
-            tank_offset = 1 if single_or_multiplayer() == 1 else 2
-
-            if tanks_list[tank_num].start_position == ai_list[tank_num - tank_offset].tank.start_position:
-                ai_list[tank_num - tank_offset] = ai.Ai(tank, game_objects_list, tanks_list, space, current_map)
-
-
-def collision_detection():
-    """Is called when a bullet collides with objects"""
-
-    handler = space.add_collision_handler(collision_types["bullet"], collision_types["tank"])
-    handler.pre_solve = collision_bullet_tank
-
-    handler = space.add_collision_handler(collision_types["bullet"], collision_types["stone"])
-    handler.pre_solve = collision_bullet_other(collision_types["stone"])
-
-    handler = space.add_collision_handler(collision_types["bullet"], collision_types["wood"])
-    handler.pre_solve = collision_bullet_other(collision_types["wood"])
-
-    handler = space.add_collision_handler(collision_types["bullet"], collision_types["metal"])
-    handler.pre_solve = collision_bullet_other(collision_types["metal"])
-
-    handler = space.add_collision_handler(collision_types["bullet"], collision_types["bounds"])
-    handler.pre_solve = collision_bullet_other(collision_types["bounds"])
-
-
-def collision_bullet_tank(arb, space, data):
-    """Is called when a bullet collides with a tank"""
-    global tanks_list, numbered_tanks, bullet_list
-
-    # Creates an explosion when a tank collides with a bullet
-    bullet = arb.shapes[1].parent
-    create_explosion(bullet)
-
-    try:
-        # Find index of removed tank
-        index_removed_tank = tanks_list.index(arb.shapes[1].parent)
-    except ValueError:
-        pass
-
-    try:
-        # Delete from both lists
-        del numbered_tanks[index_removed_tank]
-        tanks_list.remove(arb.shapes[1].parent)
-    except ValueError:
-        pass
-
-    try:
-        # Delete bullet
-        bullet_list.remove(arb.shapes[0].parent)
-        space.remove(arb.shapes[0], arb.shapes[0].body)
-    except ValueError:
-        pass
-
-    try:
-        # Delete from physics engine
-        space.remove(arb.shapes[1], arb.shapes[1].body)
-    except ValueError:
-        pass
-
-    return False
-
-
-def collision_bullet_other(type):
-    """Is called when a bullet collides with a box"""
-
-    def collision_bullet_box(arb, space, data):
-        global tanks_list, bullet_list, game_objects_list
-
-        if type == 3:       # If box is stoneblock
-            try:
-                bullet_list.remove(arb.shapes[0].parent)
-                space.remove(arb.shapes[0], arb.shapes[0].body)
-            except ValueError:
-                pass
-            return False
-
-        elif type == 4:    # If box is woodblock
-            try:
-                # Creates an explosion when a tank collides with a bullet
-                bullet = arb.shapes[1].parent
-                create_explosion(bullet)
-
-                bullet_list.remove(arb.shapes[0].parent)
-                space.remove(arb.shapes[0], arb.shapes[0].body)
-            except ValueError:
-                pass
-
-            try:
-                game_objects_list.remove(arb.shapes[1].parent)
-                space.remove(arb.shapes[1], arb.shapes[1].body)
-            except ValueError:
-                pass
-            return True
-
-        elif type == 5:     # If type is metalblock
-            try:
-                bullet_list.remove(arb.shapes[0].parent)
-                space.remove(arb.shapes[0], arb.shapes[0].body)
-            except ValueError:
-                pass
-            return False
-
-    def collision_bullet_bound(arb, space, data):
-        global bullet_list
-
-        try:
-            bullet_list.remove(arb.shapes[0].parent)
-            space.remove(arb.shapes[0], arb.shapes[0].body)
-        except ValueError:
-            pass
-        return False
-
-    return collision_bullet_box if type != 6 else collision_bullet_bound
-
-
-def create_fog_background(screen):
-    """ Creates a single black Surface() on which we draw however many circles we need """
-    fog = pygame.Surface(screen.get_size(), pygame.SRCALPHA)
-    pygame.draw.rect(fog, (0, 0, 0, 255), pygame.Rect(0, 0, current_map.width * 40, current_map.height * 40))
-
-    ai_tank_list = [ai.tank for ai in ai_list]
-
-    for tank in tanks_list:
-        gen_fog = True
-        if tank in ai_tank_list:
-            gen_fog = False
-
-        if gen_fog:
-            circle = gameobjects.FogOfwar(current_map, tank, fog)
-            circle.update()
-
-    screen.blit(fog, (0, 0))
-
-
-def main_loop():
-    """Main loop of the game"""
-    global tanks_list, game_objects_list, bullet_list, bases_list, skip_update, running
-
-    # -- Handle the events
+def handle_events():
+    """Handles the keyboard and window events of the players"""
     for event in pygame.event.get():
         detect_exit(event)
+        toggle_profile(event)
+        redraw_exposed(event)
+        if camera is not None and args.spectate:
+            move_camera(event)
 
-        for tank in tanks_list:
-            move_tank(event, tanks_list.index(tank))
-            tank_shoot(event, tank, tanks_list.index(tank))
+        for player in range(len(session.tanks_list)):
+            move_tank(event, player)
+            tank_shoot(event, player)
 
-    collision_detection()
 
-    tank_destroyed()
-
-    # Tries to constantly grab flag for all tanks
-    for tank in tanks_list:
-        tank.try_grab_flag(flag)
+def main_loop():
+    """Main loop of the game"""
 
-    # -- Update physics
-    if skip_update == 0:
-        # Loop over all the game objects and update their speed in function of their
-        # acceleration.
-        for obj in game_objects_list:
-            obj.update()
-        skip_update = 2
-    else:
-        skip_update -= 1
+    profile = session.profiler.phase
 
-    #   Check collisions and update the objects position
-    space.step(1 / FRAMERATE)
+    # -- Handle the events
+    with profile("events"):
+        handle_events()
 
-    #   Update object that depends on an other object position (for instance a flag)
-    for obj in game_objects_list:
-        obj.post_update()
+    #   Run the ticks that fit in the duration of the previous frame, then draw between the last two states.
+    #   A slow frame is made up for with more ticks, so the game keeps its pace
+    with profile("simulation"):
+        alpha = session.advance(clock.get_time() / 1000)
 
     # -- Update Display
+    with profile("render"):
+        if camera is not None:
+            camera.update(clock.get_time() / 1000, alpha)
+        rects = session.render(screen, alpha, camera)
+
+    if show_profile:
+        overlay = session.profiler.draw(screen)
+        if rects is not None:
+            rects.append(overlay)
+
+    #   Redisplay the entire screen (see double buffer technique), or only the parts that changed
+    with profile("flip"):
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
 
-    # Display the background on the screen
-    screen.blit(background, (0, 0))
-
-    # Update the display of the game objects on the screen
-    for obj in game_objects_list:
-        obj.update_screen(screen)
+    session.profiler.end_frame()
 
-    # Adds bases to the screen
-    for base in bases_list:
-        base.update_screen(screen)
+    #   Control the framerate, the simulation runs at the tick rate of the session whatever it is
+    clock.tick(FRAMERATE)
 
-    # Update tanks position and flag position if on tank
-    for tank in tanks_list:
-        tank.update_screen(screen)
-        tank.update()
-        tank.post_update()
-        tank.frames_since_last_shoot += 1
-        # Checks if tank has won
-        if tank.has_won():
-            running = False
 
-    # Update bullet positions
-    for bullet in bullet_list:
-        bullet.update_screen(screen)
-        bullet.update()
+def setup_game():
+    """Creates the screen and a session on the current level"""
+    global screen, session, camera
 
-    collision_detection()
+    # Resize the screen to the size of the current level, up to the largest window
+    level = current_map.rect()
+    screen = pygame.display.set_mode((min(level.width, MAX_WINDOW_SIZE[0]), min(level.height, MAX_WINDOW_SIZE[1])))
 
-    # Displays the explosion
-    if explosion_list:
-        for exp in explosion_list:
-            exp.update_screen(screen)
-            explosion_list.remove(exp)
+    session = GameSession(current_map, single_or_multiplayer(), args.headless,
+                          sounds.load_audio(args.headless), args.dirty_rects, play_FOW,
+                          args.tick_rate or GameSession.TICK_RATE, args.merge_rocks)
 
-    # Handles the Ai
-    for ai_tank in ai_list:
-        ai_tank.decide()
+    # The camera follows the first player, a spectator moves it around
+    camera = None
+    if screen.get_size() != level.size:
+        camera = viewport.Camera(screen.get_size(), level)
+        if session.human_players:
+            camera.follow(session.tanks[0])
 
-        if ai_tank.maybe_shoot(ai_tank.tank.body.position):
-            ai_shoot(ai_tank, ai_tank.tank.body.position)
+    if args.trace:
+        session.profiler = profiler.Profiler(enabled=True, trace=True)
 
-        if ai_tank.tank.has_won():
-            running = False
 
-    # Checks for gamemodes to play
-    if play_FOW:
-        create_fog_background(screen)
+def print_outcome(elapsed, ticks):
+    """Prints the speed and the outcome of a headless match that simulated ticks in elapsed seconds"""
+    print("Simulated %d ticks in %.2f s (%.0f ticks/sec)" % (ticks, elapsed, ticks / max(elapsed, 1e-9)))
+    if session.winner is None:
+        print("Outcome: no winner")
+    else:
+        print("Outcome: tank %d won" % session.winner)
 
-    #   Redisplay the entire screen (see double buffer technique)
-    pygame.display.flip()
 
-    #   Control the game framerate
-    clock.tick(FRAMERATE)
+def print_profile():
+    """Prints the percentiles of the phases of a headless match, in milliseconds"""
+    print("%-16s %8s %8s %8s %8s" % ("ms", "p50", "p95", "p99", "max"))
+    for name, depth, p50, p95, p99, maximum in session.profiler.summary():
+        print("%-16s %8.3f %8.3f %8.3f %8.3f" % ("  " * depth + name, p50, p95, p99, maximum))
 
 
-# -- Starts the game
-create_background()
+def play_replay():
+    """Plays the match recorded in the replay file again, on the map and with the settings it was recorded with"""
+    global session
 
-create_boxes()
+    recording = replay.Replay.load(args.replay)
+    # A map given on the command line replaces the recorded name, for map files outside of the library
+    replay_map = current_map if args.map else maps.find(recording.map_name)
+    session = GameSession(replay_map, recording.human_players, True,
+                          tick_rate=recording.tick_rate, merge_rocks=recording.merge_rocks)
+    if args.trace:
+        session.profiler = profiler.Profiler(enabled=True, trace=True)
 
-create_tanks()
+    ticks = None
+    if args.seek is not None:
+        start_time = time.perf_counter()
+        ticks = recording.seek(session, args.seek)
+        print("Jumped to tick %d in %.3f s" % (session.ticks, time.perf_counter() - start_time))
 
+    start_ticks = session.ticks
+    elapsed = recording.play(session, args.max_ticks, ticks)
+    print_outcome(elapsed, session.ticks - start_ticks)
+    if args.trace:
+        session.profiler.write_trace(args.trace)
+        print_profile()
 
-# Create numbered list where numbers correspond to tank in tank_list (Used incollision detection)
-# Creates after tanks_list is defined in function create_tanks
-numbered_tanks = list(range(len(tanks_list)))
 
-create_bases()
+def main():
+    """Starts the game"""
+    if args.replay:
+        try:
+            play_replay()
+        except (OSError, ValueError) as error:
+            sys.exit("Cannot play the replay %s: %s" % (args.replay, error))
+        return
 
-# Updates all objects every 3rd frame inside a while loop. If the user presses the X or ESCAPE, the game quits.
-# ----- Main Loop -----#
+    if not args.headless:
+        manual.disp_manual("./data/Manual/welcome.png")
+        manual.disp_manual("./data/Manual/instructions.png")
+        manual.disp_manual("./data/Manual/information.png")
 
-# -- Control whether the game run
-running = True
-skip_update = 0
+    setup_game()
 
-create_bounds()
+    if args.record:
+        session.start_recording(open(args.record, "wb"))
 
-while running:
-    main_loop()
+    try:
+        if args.headless:
+            print_outcome(session.run(args.max_ticks), session.ticks)
+            return
+
+        # Draws a frame per loop, the simulation runs the ticks of the elapsed time at its fixed tick rate
+        # (see GameSession.advance). If the user presses the X or ESCAPE, the game quits.
+        # ----- Main Loop -----#
+        while session.running:
+            main_loop()
+    finally:
+        session.stop_recording()
+        if args.trace:
+            session.profiler.write_trace(args.trace)
+            if args.headless:
+                print_profile()
+
+
+if __name__ == "__main__":
+    main()
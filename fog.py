@@ -0,0 +1,97 @@
+""" Fog of war: the level is covered in black, except around the tanks of the human players.
+"""
+import pygame
+
+import renderer
+
+FOG_COLOR = (0, 0, 0, 255)
+
+
+def create_light_stencil(radius, edge):
+    """ Returns a square surface whose alpha is opaque outside a circle of the given radius
+        and fades to transparent over edge pixels towards its centre. Blitted on the fog with
+        BLEND_RGBA_MIN, it cuts a soft-edged hole in the fog. """
+    stencil = pygame.Surface((2 * radius, 2 * radius), pygame.SRCALPHA)
+    stencil.fill(FOG_COLOR)
+    inner = radius - edge
+    # From the outside in, every smaller circle is more transparent than the previous one
+    for r in range(radius, inner - 1, -1):
+        alpha = 255 * max(r - inner, 0) // max(edge, 1)
+        pygame.draw.circle(stencil, (0, 0, 0, alpha), (radius, radius), r)
+    return stencil
+
+
+def uncovered_rects(bounds, rects):
+    """ Returns rectangles covering the part of bounds that is outside of every rectangle of rects,
+        which have to be inside of bounds. """
+    xs = sorted({bounds.left, bounds.right}.union(*((rect.left, rect.right) for rect in rects)))
+    ys = sorted({bounds.top, bounds.bottom}.union(*((rect.top, rect.bottom) for rect in rects)))
+
+    uncovered = []
+    for top, bottom in zip(ys, ys[1:]):
+        # The uncovered cells of a band are merged into one rectangle per run
+        run_left = None
+        for left, right in zip(xs, xs[1:]):
+            covered = any(rect.left <= left and right <= rect.right and rect.top <= top and bottom <= rect.bottom
+                          for rect in rects)
+            if not covered and run_left is None:
+                run_left = left
+            elif covered and run_left is not None:
+                uncovered.append(pygame.Rect(run_left, top, left - run_left, bottom - top))
+                run_left = None
+        if run_left is not None:
+            uncovered.append(pygame.Rect(run_left, top, bounds.right - run_left, bottom - top))
+    return uncovered
+
+
+class FogOfWar:
+    """ Keeps one fog surface over the whole level, with a hole around every light (the tanks
+        of the human players). The stencil of the holes is computed once, and only the fog
+        around the lights that moved since the previous frame is drawn again. """
+
+    def __init__(self, size, radius=100, edge=24):
+        """ Takes the size of the level in pixels, the radius of the light around a tank and
+            the width of its soft edge in pixels. """
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.surface.fill(FOG_COLOR)
+        self.stencil = create_light_stencil(radius, edge)
+        self.lights = {}     # Key of a light -> rect of its stencil on the fog
+        self.redrawn = 0     # Number of fog rectangles drawn again, for profiling
+
+    def update(self, positions):
+        """ Takes a dictionary of light keys (for instance tank numbers) to positions in pixels.
+            Redraws the fog where a light has appeared, moved or disappeared and returns
+            the list of fog rectangles that changed. """
+        lights = {key: self.stencil.get_rect(center=(int(x), int(y))) for key, (x, y) in positions.items()}
+
+        dirty = []
+        for key in self.lights.keys() | lights.keys():
+            old_rect = self.lights.get(key)
+            new_rect = lights.get(key)
+            if old_rect != new_rect:
+                dirty.extend(rect for rect in (old_rect, new_rect) if rect is not None)
+        self.lights = lights
+
+        dirty = renderer.merge_rects(dirty)
+        for area in dirty:
+            # Cover the area again, then cut the holes of every light overlapping it
+            self.surface.set_clip(area)
+            self.surface.fill(FOG_COLOR, area)
+            for rect in lights.values():
+                if rect.colliderect(area):
+                    self.surface.blit(self.stencil, rect, special_flags=pygame.BLEND_RGBA_MIN)
+        self.surface.set_clip(None)
+
+        self.redrawn += len(dirty)
+        return dirty
+
+    def draw(self, surface):
+        """ Draws the fog over surface. Only the fog around the lights has to be blended,
+            everywhere else it is opaque and simply filled. """
+        bounds = surface.get_rect()
+        # Blitting an area partly outside of the fog would shift it, so the lights are clipped first
+        lights = [rect.clip(bounds) for rect in renderer.merge_rects(self.lights.values()) if rect.colliderect(bounds)]
+        for area in lights:
+            surface.blit(self.surface, area, area)
+        for area in uncovered_rects(bounds, lights):
+            surface.fill(FOG_COLOR[:3], area)
@@ -1,6 +1,7 @@
 """ This module contains support for the different game objects: tank, boxes...
 """
 import math
+from collections import OrderedDict
 import pygame
 import pymunk
 import images
@@ -16,12 +17,59 @@ def physics_to_display(x):
     return x * images.TILE_SIZE
 
 
+# Rotating a sprite is the most expensive part of drawing it, so rotated sprites are kept and reused.
+class RotationCache:
+    """ Bounded LRU cache of rotated sprites, keyed by the sprite and its angle
+        rounded to a bucket of `step` degrees. """
+
+    def __init__(self, step=2, max_size=1024):
+        """ `step` is the size of an angle bucket in degrees (it should divide 360) and
+            `max_size` the number of rotated sprites kept before the least recently used is dropped. """
+        self.step = step
+        self.max_size = max_size
+        self.sprites = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def rotate(self, sprite, angle):
+        """ Returns the sprite rotated by angle degrees, rounded to the nearest bucket. """
+        bucket = round(angle / self.step) % round(360 / self.step)
+        key = (sprite, bucket)
+
+        rotated = self.sprites.get(key)
+        if rotated is not None:
+            self.hits += 1
+            self.sprites.move_to_end(key)
+            return rotated
+
+        self.misses += 1
+        rotated = pygame.transform.rotate(sprite, bucket * self.step)
+        self.sprites[key] = rotated
+        if len(self.sprites) > self.max_size:
+            self.sprites.popitem(last=False)
+        return rotated
+
+    def clear(self):
+        """ Drops every cached sprite and resets the counters. """
+        self.sprites.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+rotation_cache = RotationCache()
+
+
 # GameObject creates every graphical object on the screen.
 class GameObject:
     """ Mostly handles visual aspects (pygame) of an object.
         Subclasses need to implement two functions:
         - screen_position    that will return the position of the object on the screen
-        - screen_orientation that will return how much the object is rotated on the screen (in degrees). """
+        - screen_orientation that will return how much the object is rotated on the screen (in degrees).
+        Both take alpha, the fraction of a tick elapsed since the last state of the simulation:
+        the object is drawn between its state before that tick (see save_previous) and its current one. """
+
+    # Subclasses without __slots__ still get a __dict__, this only keeps small objects (bullets) compact
+    __slots__ = ("sprite",)
 
     def __init__(self, sprite):
         self.sprite = sprite
@@ -36,13 +84,17 @@ class GameObject:
             other objects than itself."""
         return
 
-    def update_screen(self, screen):
-        """ Updates the visual part of the game. Should NOT need to be changed
-            by a subclass."""
+    def save_previous(self):
+        """ Should be implemented in a subclass that moves. Called before every tick, keeps
+            the state the object is drawn from when the screen is between two ticks."""
+        return
+
+    def screen_sprite(self, alpha=1.0):
+        """ Returns the rotated sprite of the object and the screen rectangle it covers. """
         sprite = self.sprite
 
-        p = self.screen_position()  # Get the position of the object (pygame coordinates)
-        sprite = pygame.transform.rotate(sprite, self.screen_orientation())  # Rotate the sprite using the rotation of the object
+        p = self.screen_position(alpha)  # Get the position of the object (pygame coordinates)
+        sprite = rotation_cache.rotate(sprite, self.screen_orientation(alpha))  # Rotate the sprite using the rotation of the object
 
         # The position of the screen correspond to the center of the object,
         # But the function screen.blit expect to receive the top left corner
@@ -51,7 +103,13 @@ class GameObject:
         # Corner of the sprite
         offset = pymunk.Vec2d(*sprite.get_size()) / 2.
         p = p - offset
-        screen.blit(sprite, p)  # Copy the sprite on the screen
+        return sprite, sprite.get_rect(topleft=(int(p[0]), int(p[1])))
+
+    def update_screen(self, screen, alpha=1.0):
+        """ Updates the visual part of the game. Should NOT need to be changed
+            by a subclass. Returns the area of the screen that was drawn."""
+        sprite, rect = self.screen_sprite(alpha)
+        return screen.blit(sprite, rect)  # Copy the sprite on the screen
 
 
 # Child class to GameObject. Handles the physical aspect of the game.
@@ -61,6 +119,8 @@ class GamePhysicsObject(GameObject):
         interaction of the objects.
     """
 
+    __slots__ = ("body", "shape", "points", "previous")
+
     def __init__(self, x, y, orientation, sprite, space, movable):
         """ Takes as parameters the starting coordinate (x,y), the orientation, the sprite (aka the image
             representing the object), the physic engine object (space) and whether the object can be
@@ -94,6 +154,7 @@ class GamePhysicsObject(GameObject):
         self.body.angle = math.radians(orientation)       # orientation is provided in degress, but pymunk expects radians.
         self.shape = pymunk.Poly(self.body, points)  # Create a polygon shape using the corner of the rectangle
         self.shape.parent = self
+        self.previous = None  # Position and angle of the body before the last tick
 
         # Set some value for friction and elasticity, which defines interraction in case of a colision
         # self.shape.friction = 0.5
@@ -102,16 +163,37 @@ class GamePhysicsObject(GameObject):
         # Add the object to the physic engine
         space.add(self.body, self.shape)
 
-    def screen_position(self):
+    def save_previous(self):
+        self.previous = (self.body.position, self.body.angle)
+
+    def body_state(self):
+        """ Returns the position, velocity, angle and angular velocity of the body as plain numbers. """
+        body = self.body
+        return tuple(body.position), tuple(body.velocity), body.angle, body.angular_velocity
+
+    def set_body_state(self, state):
+        """ Puts the body back in a state returned by body_state(). """
+        position, velocity, angle, angular_velocity = state
+        self.body.position = position
+        self.body.velocity = velocity
+        self.body.angle = angle
+        self.body.angular_velocity = angular_velocity
+        self.previous = None
+
+    def screen_position(self, alpha=1.0):
         """ Converts the body's position in the physics engine to screen coordinates. """
-        return physics_to_display(self.body.position)
+        if self.previous is None or alpha >= 1.0:
+            return physics_to_display(self.body.position)
+        return physics_to_display(self.previous[0].interpolate_to(self.body.position, alpha))
 
-    def screen_orientation(self):
+    def screen_orientation(self, alpha=1.0):
         """ Angles are reversed from the engine to the display. """
-        return -math.degrees(self.body.angle)
+        if self.previous is None or alpha >= 1.0:
+            return -math.degrees(self.body.angle)
+        return -math.degrees(self.previous[1] + (self.body.angle - self.previous[1]) * alpha)
 
-    def update_screen(self, screen):
-        super().update_screen(screen)
+    def update_screen(self, screen, alpha=1.0):
+        rect = super().update_screen(screen, alpha)
         # debug draw
         if DEBUG:
             ps = [self.body.position + p for p in self.points]
@@ -119,6 +201,7 @@ class GamePhysicsObject(GameObject):
             ps = [physics_to_display(p) for p in ps]
             ps += [ps[0]]
             pygame.draw.lines(screen, pygame.color.THECOLORS["red"], False, ps, 1)
+        return rect
 
 
 def clamp(min_max, value):
@@ -150,38 +233,51 @@ class Tank(GamePhysicsObject):
         self.x = x
         self.y = y
         self.score = 0
+        self.command_listener = None    # Called with the tank and the name of every command it gets, to record them
+
+    def notify(self, command):
+        """ Tells the command listener, if there is one, that the tank got command. """
+        if self.command_listener is not None:
+            self.command_listener(self, command)
 
     def accelerate(self):
         """ Call this function to make the tank move forward. """
+        self.notify("accelerate")
         self.acceleration = 1
 
     def stop_moving(self):
         """ Call this function to make the tank stop moving. """
+        self.notify("stop_moving")
         self.acceleration = 0
         self.body.velocity = pymunk.Vec2d.zero()
 
     def decelerate(self):
         """ Call this function to make the tank move backward. """
+        self.notify("decelerate")
         self.acceleration = -1
 
     def turn_left(self):
         """ Makes the tank turn left (counter clock-wise). """
+        self.notify("turn_left")
         self.rotation = -1
 
     def turn_right(self):
         """ Makes the tank turn right (clock-wise). """
+        self.notify("turn_right")
         self.rotation = 1
 
     def stop_turning(self):
         """ Call this function to make the tank stop turning. """
+        self.notify("stop_turning")
         self.rotation = 0
         self.body.angular_velocity = 0
 
-    def update(self):
-        """ A function to update the objects coordinates. Gets called at every tick of the game. """
+    def update(self, time_scale=1.0):
+        """ A function to update the objects coordinates. Gets called at every tick of the game.
+            time_scale is the length of a tick relative to the ticks the constants were tuned for (see session.TICK_RATE). """
 
         # Creates a vector in the direction we want accelerate / decelerate
-        acceleration_vector = pymunk.Vec2d(0, self.ACCELERATION * self.acceleration).rotated(self.body.angle)
+        acceleration_vector = pymunk.Vec2d(0, self.ACCELERATION * self.acceleration * time_scale).rotated(self.body.angle)
         # Applies the vector to our velocity
         self.body.velocity += acceleration_vector
 
@@ -190,7 +286,7 @@ class Tank(GamePhysicsObject):
         self.body.velocity = pymunk.Vec2d(velocity, 0).rotated(self.body.velocity.angle)
 
         # Updates the rotation
-        self.body.angular_velocity += self.rotation * self.ACCELERATION
+        self.body.angular_velocity += self.rotation * self.ACCELERATION * time_scale
         self.body.angular_velocity = clamp(self.max_speed, self.body.angular_velocity)
 
     def post_update(self):
@@ -221,8 +317,8 @@ class Tank(GamePhysicsObject):
         """ Check if the current tank has won (if it is has the flag and it is close to its start position). """
         return self.flag is not None and (self.start_position - self.body.position).length < 0.2
 
-    def shoot(self, space, is_ai_tank=False):
-        """ Call this function to shoot a missile (current implementation does nothing ! you need to implement it yourself) """
+    def shoot(self, bullet_pool, is_ai_tank=False):
+        """ Call this function to shoot a missile. The bullet is taken from bullet_pool (a BulletPool) and returned. """
         tank_x = self.body.position[0]
         tank_y = self.body.position[1]
         angle = self.body.angle
@@ -233,7 +329,7 @@ class Tank(GamePhysicsObject):
         bullet_x = tank_x - bullet_offset * math.sin(angle)
         bullet_y = tank_y + bullet_offset * math.cos(angle)
 
-        bullet = Bullet(bullet_x, bullet_y, angle, images.bullet, space, is_ai_tank)
+        bullet = bullet_pool.acquire(bullet_x, bullet_y, angle, is_ai_tank)
 
         # Recoil is handled here
         recoil_acceleration = 1
@@ -290,19 +386,27 @@ class GameVisibleObject(GameObject):
         self.x = x
         self.y = y
         self.orientation = 0
+        self.previous = None  # Position and orientation before the last tick
         super().__init__(sprite)
 
     def physical_position(self):
         """ Returns physical position of flag """
         return pymunk.Vec2d(self.x, self.y)
 
-    def screen_position(self):
+    def save_previous(self):
+        self.previous = (pymunk.Vec2d(self.x, self.y), self.orientation)
+
+    def screen_position(self, alpha=1.0):
         """ Overwrite from GameObject """
-        return physics_to_display(pymunk.Vec2d(self.x, self.y))
+        if self.previous is None or alpha >= 1.0:
+            return physics_to_display(pymunk.Vec2d(self.x, self.y))
+        return physics_to_display(self.previous[0].interpolate_to(pymunk.Vec2d(self.x, self.y), alpha))
 
-    def screen_orientation(self):
+    def screen_orientation(self, alpha=1.0):
         """ Overwrite from GameObject """
-        return self.orientation
+        if self.previous is None or alpha >= 1.0:
+            return self.orientation
+        return self.previous[1] + (self.orientation - self.previous[1]) * alpha
 
 
 # A class that only handles the flag.
@@ -316,23 +420,100 @@ class Flag(GameVisibleObject):
 
 
 class Bullet(GamePhysicsObject):
+    """ Bullets are created and reused by a BulletPool, they are never created directly. """
 
     SPEED = 2.0
 
+    __slots__ = ("orientation", "x", "y", "is_ai_tank", "speed", "shooter", "age", "index")
+
     def __init__(self, x, y, orientation, sprite, space, is_ai_tank):
         super().__init__(x, y, orientation, sprite, space, True)
-        self.orientation = orientation
         self.shape.collision_type = 1
+        self.index = -1   # Position in the list of active bullets of the pool, -1 when the bullet is not in use
+        self.reset(x, y, orientation, is_ai_tank)
+
+    def reset(self, x, y, orientation, is_ai_tank):
+        """ Puts the bullet back in the state of a newly shot bullet. """
+        self.body.position = x, y
+        self.body.angle = math.radians(orientation)
+        self.body.velocity = pymunk.Vec2d.zero()
+        self.body.angular_velocity = 0
+        self.orientation = orientation
         self.x = x
         self.y = y
         self.is_ai_tank = is_ai_tank
+        self.speed = self.SPEED * 1.4 if is_ai_tank else self.SPEED
+        self.shooter = None
+        self.age = 0
+        self.previous = None
+
+    def update(self, time_scale=1.0):
+        acceleration_vector = pymunk.Vec2d(0, self.speed * time_scale).rotated(self.orientation)
+        self.body.velocity += acceleration_vector
+
+
+def remove_after_step(space, key, *objs):
+    """ Post step callback removing objs from space, see Space.add_post_step_callback(). Removing a body
+        wakes up the boxes asleep against it, so the order of the removals changes the match. pymunk
+        keeps what is removed during a step in a set, whose order changes from run to run, while the
+        post step callbacks run in the order they were added. """
+    space.remove(*objs)
+
+
+class BulletPool:
+    """ Reuses bullets, with their pymunk body and shape, instead of creating new ones for every shot.
+        The bullets in use are kept in `active`. A bullet knows its index in that list, so when
+        it is released the last bullet takes its place and removal is O(1). """
+
+    MAX_AGE = 250  # Ticks after which a bullet that has not hit anything is removed (at session.TICK_RATE)
 
-        if self.is_ai_tank:
-            self.SPEED *= 1.4
+    def __init__(self, space, max_age=MAX_AGE):
+        self.space = space
+        self.max_age = max_age
+        self.active = []
+        self.free = []
+
+    def acquire(self, x, y, orientation, is_ai_tank):
+        """ Returns a bullet at (x, y) that has been added to the space. """
+        if self.free:
+            bullet = self.free.pop()
+            bullet.reset(x, y, orientation, is_ai_tank)
+            self.space.add(bullet.body, bullet.shape)
+        else:
+            bullet = Bullet(x, y, orientation, images.bullet, self.space, is_ai_tank)
+
+        bullet.index = len(self.active)
+        self.active.append(bullet)
+        return bullet
+
+    def release(self, bullet, in_step=False):
+        """ Removes the bullet from the space and keeps it for later use, in_step is True when it is
+            released by a collision callback (see remove_after_step). Returns False if the bullet
+            had already been released, which happens when it hits several shapes in one step. """
+        if bullet.index < 0:
+            return False
+
+        last = self.active.pop()
+        if last is not bullet:
+            self.active[bullet.index] = last
+            last.index = bullet.index
+        bullet.index = -1
+
+        if in_step:
+            self.space.add_post_step_callback(remove_after_step, bullet, bullet.shape, bullet.body)
+        else:
+            self.space.remove(bullet.shape, bullet.body)
+        self.free.append(bullet)
+        return True
 
     def update(self):
-        acceleration_vector = pymunk.Vec2d(0, self.SPEED).rotated(self.orientation)
-        self.body.velocity += acceleration_vector
+        """ Ages the active bullets by one tick and releases those older than max_age. """
+        # Backwards, so that the bullets moved by a release have already been visited
+        for i in range(len(self.active) - 1, -1, -1):
+            bullet = self.active[i]
+            bullet.age += 1
+            if bullet.age > self.max_age:
+                self.release(bullet)
 
 
 class Explosion(GameVisibleObject):
@@ -344,13 +525,3 @@ class Explosion(GameVisibleObject):
     def update(self):
         pass
 
-
-class FogOfwar:
-    def __init__(self, current_map, tank, fog_background):
-        self.tank = tank
-        self.multiplier = pygame.display.get_surface().get_size()[0] / current_map.width
-
-        self.fog = fog_background
-
-    def update(self):
-        pygame.draw.circle(self.fog, (0, 0, 255, 0), (self.tank.body.position[0] * self.multiplier, self.tank.body.position[1] * self.multiplier), 100)
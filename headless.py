@@ -0,0 +1,18 @@
+""" Prepares pygame for the tools that run the game without window or sound (benchmark.py,
+    tournament.py and mapgen.py). The game modules load their images on import, so init()
+    has to be called before they are imported.
+"""
+import os
+
+
+def init():
+    """ Selects the dummy drivers of SDL and gives pygame the display mode it needs to load images. """
+    # The dummy drivers have to be selected before pygame is initialised
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    # SDL would catch the SIGTERM a process pool uses to stop its workers
+    os.environ["SDL_NO_SIGNAL_HANDLERS"] = "1"
+    import pygame
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
@@ -0,0 +1,138 @@
+""" Procedural maps, to see how the game copes with maps much larger than the bundled ones.
+    A map is made from a seed, so the same options always give the same map.
+    maps loads the images, so pygame needs a display mode before this module is imported.
+"""
+import heapq
+import math
+import os
+import random
+from argparse import ArgumentParser
+
+if __name__ == "__main__":
+    # Run as a script the maps are only written to files, the dummy drivers are enough
+    import headless
+    headless.init()
+
+import maps
+
+MIN_SIZE = 5
+MAX_SIZE = 256
+
+# Cost of going through a tile a tank cannot drive on when the paths to the flag are carved,
+# the higher it is, the longer the detours taken to keep the boxes
+CARVE_COST = 4
+
+
+def border_tiles(width, height):
+    """ Returns the tiles along the border of the map, clockwise from the top left corner. """
+    top = [(x, 0) for x in range(width)]
+    right = [(width - 1, y) for y in range(1, height)]
+    bottom = [(x, height - 1) for x in range(width - 2, -1, -1)]
+    left = [(0, y) for y in range(height - 2, 0, -1)]
+    return top + right + bottom + left
+
+
+def facing(source, target):
+    """ Returns the orientation, in degrees, of a tank on source facing target (rounded to a quarter turn).
+        A tank with orientation 0 faces down, 90 left, 180 up and 270 right. """
+    angle = math.degrees(math.atan2(source[0] - target[0], target[1] - source[1]))
+    return round(angle / 90) % 4 * 90
+
+
+def carve_paths(current_map, target, sources):
+    """ Clears the boxes on the way from every tile of sources to target, so that a tank can
+        drive from any of them to target. The tiles a tank cannot drive on cost CARVE_COST,
+        so the paths go around the boxes when the detour is short. """
+    mask = maps.passable_mask()
+    flags = current_map.flags
+    neighbor_indices = current_map.neighbor_indices
+
+    # Dijkstra from the target, every tile then knows the next tile on its way to the target
+    start = current_map.index(*target)
+    costs = {start: 0}
+    next_tile = {start: None}
+    queue = [(0, start)]
+    while queue:
+        cost, index = heapq.heappop(queue)
+        if cost > costs[index]:
+            continue
+        for neighbor in neighbor_indices[index]:
+            neighbor_cost = cost + (1 if flags[neighbor] & mask else CARVE_COST)
+            if neighbor_cost < costs.get(neighbor, math.inf):
+                costs[neighbor] = neighbor_cost
+                next_tile[neighbor] = index
+                heapq.heappush(queue, (neighbor_cost, neighbor))
+
+    # Carving only makes tiles passable, so a path cleared earlier stays clear
+    for source in sources:
+        index = current_map.index(*source)
+        while index is not None:
+            if not flags[index] & mask:
+                current_map.set_box(*current_map.tile(index), maps.GRASS)
+            index = next_tile[index]
+
+
+def generate(width, height, seed=0, rock=0.2, wood=0.1, metal=0.05, tanks=4, name=None):
+    """ Returns a maps.Map of width x height tiles, made from seed. rock, wood and metal are the
+        fractions of the tiles with a box of that type before the paths are carved. The tanks
+        start spread along the border, facing the flag in the middle, and every one of them
+        can drive to the flag. """
+    if not (MIN_SIZE <= width <= MAX_SIZE and MIN_SIZE <= height <= MAX_SIZE):
+        raise ValueError("the size of a map goes from %d to %d tiles" % (MIN_SIZE, MAX_SIZE))
+    if rock < 0 or wood < 0 or metal < 0 or rock + wood + metal > 1:
+        raise ValueError("the densities of the boxes have to add up to at most 1")
+    border = border_tiles(width, height)
+    if not 1 <= tanks <= min(maps.MAX_TANKS, len(border)):
+        raise ValueError("a %dx%d map has room for 1 to %d tanks" % (width, height, min(maps.MAX_TANKS, len(border))))
+
+    rng = random.Random(seed)
+    thresholds = (rock, rock + wood, rock + wood + metal)
+    box_types = (maps.ROCK, maps.WOOD, maps.METAL, maps.GRASS)
+    tiles = bytearray(width * height)
+    for index in range(len(tiles)):
+        value = rng.random()
+        tiles[index] = box_types[sum(value >= threshold for threshold in thresholds)]
+
+    flag = (width // 2, height // 2)
+    starts = [border[round(i * len(border) / tanks)] for i in range(tanks)]
+    start_positions = [[x + 0.5, y + 0.5, facing((x, y), flag)] for x, y in starts]
+    name = name or "generated_%dx%d_%d" % (width, height, seed)
+    current_map = maps.Map(width, height, tiles, start_positions, [flag[0] + 0.5, flag[1] + 0.5], name)
+
+    # The flag and the tanks get some room, and a way between them
+    for x, y in [flag] + starts:
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if current_map.contains(x + dx, y + dy):
+                    current_map.set_box(x + dx, y + dy, maps.GRASS)
+    carve_paths(current_map, flag, starts)
+
+    return current_map
+
+
+def main():
+    arg_parser = ArgumentParser(description="Generates a map from a seed and writes it to a map file")
+    arg_parser.add_argument("--width", type=int, default=64)
+    arg_parser.add_argument("--height", type=int, default=64)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--rock", type=float, default=0.2, help="fraction of the tiles with a rock box")
+    arg_parser.add_argument("--wood", type=float, default=0.1, help="fraction of the tiles with a wood box")
+    arg_parser.add_argument("--metal", type=float, default=0.05, help="fraction of the tiles with a metal box")
+    arg_parser.add_argument("--tanks", type=int, default=4, help="number of start positions, spread along the border")
+    arg_parser.add_argument("--name", help="name of the map (default generated_WIDTHxHEIGHT_SEED)")
+    arg_parser.add_argument("--output", metavar="FILE", help="map file to write (default data/maps/NAME.map)")
+    args = arg_parser.parse_args()
+
+    try:
+        current_map = generate(args.width, args.height, args.seed, args.rock, args.wood, args.metal, args.tanks, args.name)
+    except ValueError as error:
+        arg_parser.error(str(error))
+
+    path = args.output or os.path.join(maps.MAPS_DIRECTORY, current_map.name + maps.MAP_EXTENSION)
+    maps.save(current_map, path)
+    print("%s: %dx%d tiles, %d tanks, written to %s" % (current_map.name, current_map.width, current_map.height,
+                                                      len(current_map.start_positions), path))
+
+
+if __name__ == "__main__":
+    main()
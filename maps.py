@@ -1,27 +1,244 @@
+import os
+
 import images
 import pygame
 # This file creates the skeleton of the map. Also places tanks/bases/flag on the correct spot in the specific map.
+# Maps can also be read from files, see load().
+
+# Box types of the tiles
+GRASS = 0
+ROCK = 1
+WOOD = 2
+METAL = 3
+
+# Bits of the passability mask of a tile
+TANK_PASSABLE = 1      # A tank can drive on the tile, or shoot its way through
+PUSHABLE = 2           # A tank can push the box out of its way
+BULLET_BLOCKING = 4    # A bullet stops on the box
+DESTRUCTIBLE = 8       # A bullet destroys the box
+
+# Passability mask of every box type, as a translation table for bytearray.translate()
+BOX_FLAGS = bytearray(256)
+BOX_FLAGS[GRASS] = TANK_PASSABLE
+BOX_FLAGS[ROCK] = BULLET_BLOCKING
+BOX_FLAGS[WOOD] = TANK_PASSABLE | BULLET_BLOCKING | DESTRUCTIBLE
+BOX_FLAGS[METAL] = PUSHABLE | BULLET_BLOCKING
+BOX_FLAGS = bytes(BOX_FLAGS)
+
+# Offsets of the four neighbors of a tile, in the order they are searched
+NEIGHBOR_OFFSETS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+
+# The library of map files, a map in it is found by its name (see find())
+MAPS_DIRECTORY = os.path.join(os.path.split(os.path.abspath(__file__))[0], "data", "maps")
+MAP_EXTENSION = ".map"
+
+# A replay stores the number of a tank in one byte
+MAX_TANKS = 255
+
+# In a map file every tile is the digit of its box type, translated in place to the box type by bytes.translate()
+TILE_DIGITS = b"0123"
+TILE_CODES = bytes.maketrans(TILE_DIGITS, bytes([GRASS, ROCK, WOOD, METAL]))
+
+
+def passable_mask(include_metal_box=False):
+    """ Returns the mask of the tiles a tank can get through, optionally pushing metal boxes. """
+    return TANK_PASSABLE | PUSHABLE if include_metal_box else TANK_PASSABLE
 
 
 class Map:
-    """ An instance of Map is a blueprint for how the game map will look. """
+    """ An instance of Map is a blueprint for how the game map will look.
+        The tiles are stored row after row in a bytearray, the tile (x, y) has the index y * width + x. """
 
-    def __init__(self, width, height, boxes, start_positions, flag_position):
-        """ Takes as argument the size of the map (width, height), an array with the boxes type,
-        the start position of tanks (start_positions) and the position of the flag (flag_position).
+    def __init__(self, width, height, boxes, start_positions, flag_position, name=""):
+        """ Takes as argument the size of the map (width, height), an array with the boxes type
+        (or a bytearray of the box types row after row, which the map keeps),
+        the start position of tanks (start_positions), the position of the flag (flag_position)
+        and the name of the map.
         """
+        self.name = name
         self.width = width
         self.height = height
-        self.boxes = boxes
+        if isinstance(boxes, bytearray):
+            self.tiles = boxes
+        else:
+            self.tiles = bytearray(box for row in boxes for box in row)
+        self.flags = self.tiles.translate(BOX_FLAGS)
         self.start_positions = start_positions
         self.flag_position = flag_position
 
+        # Indices of the neighbors of every tile inside the map, in the order of NEIGHBOR_OFFSETS
+        self.neighbor_indices = [tuple((y + dy) * width + x + dx for dx, dy in NEIGHBOR_OFFSETS
+                                       if 0 <= x + dx < width and 0 <= y + dy < height)
+                                 for y in range(height) for x in range(width)]
+
     def rect(self):
         return pygame.Rect(0, 0, images.TILE_SIZE * self.width, images.TILE_SIZE * self.height)
 
+    def index(self, x, y):
+        """ Returns the index of the tile at coordinates (x, y). """
+        return y * self.width + x
+
+    def tile(self, index):
+        """ Returns the coordinates (x, y) of the tile at index. """
+        y, x = divmod(index, self.width)
+        return x, y
+
+    def contains(self, x, y):
+        """ Returns True if the coordinates (x, y) are inside the map. """
+        return 0 <= x < self.width and 0 <= y < self.height
+
     def boxAt(self, x, y):
         """ Return the type of the box at coordinates (x, y). """
-        return self.boxes[y][x]
+        return self.tiles[y * self.width + x]
+
+    def set_box(self, x, y, box_type):
+        """ Changes the type of the box at coordinates (x, y). """
+        index = y * self.width + x
+        self.tiles[index] = box_type
+        self.flags[index] = BOX_FLAGS[box_type]
+
+    def indices_with(self, mask):
+        """ Returns the indices of every tile with one of the bits of mask. """
+        flags = self.flags
+        return [index for index in range(len(flags)) if flags[index] & mask]
+
+    def tiles_with(self, mask):
+        """ Returns the coordinates (x, y) of every tile with one of the bits of mask. """
+        return [self.tile(index) for index in self.indices_with(mask)]
+
+    def rectangles(self, box_type):
+        """ Returns rectangles (x, y, width, height) of tiles covering every tile of box_type once.
+            Each rectangle is grown greedily, first along its row and then down the following
+            rows, so a wall of boxes becomes a few rectangles instead of one per tile. """
+        width = self.width
+        tiles = self.tiles
+        covered = bytearray(len(tiles))
+        rectangles = []
+        for index in range(len(tiles)):
+            if tiles[index] != box_type or covered[index]:
+                continue
+            x, y = index % width, index // width
+
+            run = 1
+            while x + run < width and tiles[index + run] == box_type and not covered[index + run]:
+                run += 1
+
+            rows = 1
+            while y + rows < self.height:
+                start = index + rows * width
+                if any(tiles[i] != box_type or covered[i] for i in range(start, start + run)):
+                    break
+                rows += 1
+
+            for row in range(rows):
+                start = index + row * width
+                covered[start:start + run] = b"\x01" * run
+            rectangles.append((x, y, run, rows))
+        return rectangles
+
+
+def parse(lines, name=""):
+    """ Reads a map from lines of bytes, for instance a file opened in binary mode:
+
+            # Comments and empty lines are ignored
+            name: map0
+            start: 0.5 0.5 0      (x, y and orientation of a tank, one line per tank)
+            flag: 4.5 4.5
+            grid
+            010000010             (one line per row of tiles, the digit of the box type of every tile)
+
+        The rows are translated into the tiles of the map as they are read, so a large map is
+        never held in memory as text. name is used when the file has no name. Raises
+        ValueError, with the number of the line, if the map is not valid. """
+    start_positions = []
+    flag_position = None
+    tiles = bytearray()
+    width = None
+    height = 0
+    in_grid = False
+
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith(b"#"):
+            continue
+
+        if in_grid:
+            if line.translate(None, TILE_DIGITS):
+                raise ValueError("line %d: a row can only contain the digits %s" % (number, TILE_DIGITS.decode()))
+            if width is None:
+                width = len(line)
+            elif len(line) != width:
+                raise ValueError("line %d: the row has %d tiles instead of %d" % (number, len(line), width))
+            tiles += line.translate(TILE_CODES)
+            height += 1
+            continue
+
+        key, _, value = line.decode().partition(":")
+        key = key.strip()
+        try:
+            if key == "grid":
+                in_grid = True
+            elif key == "name":
+                name = value.strip()
+            elif key == "start":
+                x, y, orientation = map(float, value.split())
+                start_positions.append([x, y, orientation])
+            elif key == "flag":
+                x, y = map(float, value.split())
+                flag_position = [x, y]
+            else:
+                raise ValueError("unknown key %r" % key)
+        except ValueError as error:
+            raise ValueError("line %d: %s" % (number, error)) from None
+
+    if not height:
+        raise ValueError("the map has no grid")
+    if flag_position is None or not start_positions:
+        raise ValueError("the map needs a flag and at least one start position")
+    if len(start_positions) > MAX_TANKS:
+        raise ValueError("the map has %d start positions, at most %d are allowed" % (len(start_positions), MAX_TANKS))
+    for x, y in [position[:2] for position in start_positions] + [flag_position]:
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError("the position (%g, %g) is outside of the map" % (x, y))
+
+    return Map(width, height, tiles, start_positions, flag_position, name)
+
+
+def load(path):
+    """ Reads the map file at path, a map without name is named after the file. """
+    with open(path, "rb") as file:
+        return parse(file, os.path.splitext(os.path.basename(path))[0])
+
+
+def save(current_map, path):
+    """ Writes current_map to a map file that load() reads back. """
+    with open(path, "wb") as file:
+        file.write(b"name: %s\n" % current_map.name.encode())
+        for x, y, orientation in current_map.start_positions:
+            file.write(b"start: %g %g %g\n" % (x, y, orientation))
+        file.write(b"flag: %g %g\n" % tuple(current_map.flag_position))
+        file.write(b"grid\n")
+        digits = current_map.tiles.translate(bytes.maketrans(bytes([GRASS, ROCK, WOOD, METAL]), TILE_DIGITS))
+        for y in range(current_map.height):
+            file.write(digits[y * current_map.width:(y + 1) * current_map.width] + b"\n")
+
+
+def find(name):
+    """ Returns the map called name: one of the maps of this module (map0, map1, map2), a map of
+        the library (MAPS_DIRECTORY/name.map) or the map file at the path name. """
+    bundled = globals().get(name)
+    if isinstance(bundled, Map):
+        return bundled
+    if name.endswith(MAP_EXTENSION) or os.sep in name:
+        return load(name)
+    return load(os.path.join(MAPS_DIRECTORY, name + MAP_EXTENSION))
+
+
+def library():
+    """ Returns the names of the maps of the library, sorted. """
+    if not os.path.isdir(MAPS_DIRECTORY):
+        return []
+    return sorted(os.path.splitext(entry)[0] for entry in os.listdir(MAPS_DIRECTORY) if entry.endswith(MAP_EXTENSION))
 
 
 map0 = Map(9, 9,
@@ -34,7 +251,7 @@ map0 = Map(9, 9,
             [0, 2, 0, 1, 0, 1, 0, 2, 0],
             [0, 1, 0, 2, 0, 2, 0, 1, 0],
             [0, 1, 0, 0, 0, 0, 0, 1, 0]],
-           [[0.5, 0.5, 0], [8.5, 0.5, 0], [0.5, 8.5, 180], [8.5, 8.5, 180]], [4.5, 4.5])
+           [[0.5, 0.5, 0], [8.5, 0.5, 0], [0.5, 8.5, 180], [8.5, 8.5, 180]], [4.5, 4.5], "map0")
 
 map1 = Map(15, 11,
            [[0, 2, 0, 0, 0, 2, 0, 0, 0, 2, 0, 0, 0, 2, 0],
@@ -48,7 +265,7 @@ map1 = Map(15, 11,
             [0, 1, 0, 3, 1, 1, 0, 0, 0, 1, 1, 3, 0, 1, 0],
             [0, 1, 1, 0, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0],
             [0, 2, 0, 0, 0, 2, 0, 0, 0, 2, 0, 0, 0, 2, 0]],
-           [[0.5, 0.5, 0], [14.5, 0.5, 0], [0.5, 10.5, 180], [14.5, 10.5, 180], [7.5, 0.5, 0], [7.5, 10.5, 180]], [7.5, 5.5])
+           [[0.5, 0.5, 0], [14.5, 0.5, 0], [0.5, 10.5, 180], [14.5, 10.5, 180], [7.5, 0.5, 0], [7.5, 10.5, 180]], [7.5, 5.5], "map1")
 
 map2 = Map(10, 5,
            [[0, 2, 0, 2, 0, 0, 2, 0, 2, 0],
@@ -56,4 +273,4 @@ map2 = Map(10, 5,
             [0, 1, 0, 1, 0, 0, 1, 0, 1, 0],
             [0, 3, 0, 1, 3, 3, 1, 0, 3, 0],
             [0, 2, 0, 2, 0, 0, 2, 0, 2, 0]],
-           [[0.5, 2.5, 270], [9.5, 2.5, 90]], [5, 2.5])
+           [[0.5, 2.5, 270], [9.5, 2.5, 90]], [5, 2.5], "map2")
@@ -0,0 +1,251 @@
+""" Path finding on the tile grid of a map. The distance fields are shared by every Ai of a session.
+"""
+import heapq
+import math
+from collections import OrderedDict, deque
+
+from pymunk import Vec2d
+
+import maps
+
+
+def tile_neighbors(current_map, tile, include_metal_box):
+    """ Returns the tiles bordering tile (integer coordinates) that a tank can drive to. """
+    mask = maps.passable_mask(include_metal_box)
+    flags = current_map.flags
+    return [current_map.tile(neighbor) for neighbor in current_map.neighbor_indices[current_map.index(*tile)]
+            if flags[neighbor] & mask]
+
+
+class DistanceField:
+    """ The distance, in tiles, from every tile of a map to one target tile.
+        It is computed once with a breadth first search starting at the target, after
+        which the shortest path from any tile can be read without searching. """
+
+    def __init__(self, current_map, target, include_metal_box):
+        """ Takes the map, the target tile (integer coordinates) and whether metal boxes are passable. """
+        self.current_map = current_map
+        self.target = target
+        self.distances = [-1] * (current_map.width * current_map.height)  # -1 for tiles from which the target cannot be reached
+
+        mask = maps.passable_mask(include_metal_box)
+        flags = current_map.flags
+        if not current_map.contains(*target) or not flags[current_map.index(*target)] & mask:
+            return
+
+        # The search runs on tile indices, with the neighbors precomputed by the map
+        distances = self.distances
+        neighbor_indices = current_map.neighbor_indices
+        start = current_map.index(*target)
+        distances[start] = 0
+        queue = deque([start])
+        while queue:
+            index = queue.popleft()
+            distance = distances[index] + 1
+            for neighbor in neighbor_indices[index]:
+                if distances[neighbor] < 0 and flags[neighbor] & mask:
+                    distances[neighbor] = distance
+                    queue.append(neighbor)
+
+    def distance(self, tile):
+        """ Returns the number of steps from tile to the target, -1 if the target cannot be reached. """
+        if self.current_map.contains(*tile):
+            return self.distances[self.current_map.index(*tile)]
+        return -1
+
+    def closest_neighbor(self, index, distance):
+        """ Returns the index of the first neighbor of the tile at index that is distance steps
+            from the target, None if there is none. """
+        for neighbor in self.current_map.neighbor_indices[index]:
+            if self.distances[neighbor] == distance:
+                return neighbor
+        return None
+
+    def path_from(self, source):
+        """ Returns the shortest path from source to the target, as a deque of tile centres
+            (Vec2d) starting with source. The deque is empty if the target cannot be reached. """
+        path = deque([Vec2d(source[0] + 0.5, source[1] + 0.5)])
+        if source == self.target:
+            return path
+        if not self.current_map.contains(*source):
+            return deque()
+
+        width = self.current_map.width
+        index = self.current_map.index(*source)
+        distance = self.distances[index]
+
+        # The tank may stand on a tile it could not drive to (a pushed metal box), it can still leave it
+        if distance < 0:
+            reachable = [self.distances[neighbor] for neighbor in self.current_map.neighbor_indices[index]
+                         if self.distances[neighbor] >= 0]
+            if not reachable:
+                return deque()
+            distance = min(reachable) + 1
+
+        while distance > 0:
+            distance -= 1
+            index = self.closest_neighbor(index, distance)
+            y, x = divmod(index, width)
+            path.append(Vec2d(x + 0.5, y + 0.5))
+
+        return path
+
+
+class PathFinder:
+    """ Keeps the distance fields of the targets the Ai are heading to (the flag and the bases).
+        A field is only computed when a target tile is asked for the first time, every Ai
+        heading to the same tile then reads the same field. """
+
+    def __init__(self, current_map, max_fields=32):
+        """ Takes the map and the number of distance fields kept before the least recently used is dropped. """
+        self.current_map = current_map
+        self.max_fields = max_fields
+        self.fields = OrderedDict()
+        self.searches = 0   # Number of distance fields computed
+        self.lookups = 0    # Number of paths read from an existing field
+
+    def distance_field(self, target, include_metal_box=False):
+        """ Returns the distance field of the target tile (integer coordinates). """
+        key = (target, include_metal_box)
+        field = self.fields.get(key)
+        if field is not None:
+            self.lookups += 1
+            self.fields.move_to_end(key)
+            return field
+
+        self.searches += 1
+        field = DistanceField(self.current_map, target, include_metal_box)
+        self.fields[key] = field
+        if len(self.fields) > self.max_fields:
+            self.fields.popitem(last=False)
+        return field
+
+    def find_shortest_path(self, source, target, include_metal_box=False):
+        """ Returns the shortest path between two tile centres (Vec2d) as a deque of tile centres. """
+        source = (int(source[0]), int(source[1]))
+        target = (int(target[0]), int(target[1]))
+        return self.distance_field(target, include_metal_box).path_from(source)
+
+
+class DStarLite:
+    """ Incremental shortest path planner (D* Lite) for an Ai chasing a target that moves.
+        The search runs backwards from the goal and keeps its results between calls, so when
+        the start or the goal moves, only the part of the search affected by the move is
+        expanded again. The boxes of the map never change what a tank can drive on (wood
+        is passable before it is shot), so the cost of a tile never changes.
+        A moving goal is handled like a change of edge costs: the old goal loses its
+        zero cost and the new goal gets it. """
+
+    def __init__(self, current_map, start, goal, include_metal_box=False):
+        """ Takes the map, the start and goal tiles (integer coordinates) and whether metal boxes are passable. """
+        self.current_map = current_map
+        self.mask = maps.passable_mask(include_metal_box)
+        # The search runs on tile indices, start and goal are kept as indices too
+        self.start = current_map.index(*start)
+        self.goal = current_map.index(*goal)
+        self.km = 0                # Sum of the heuristic distances the start has moved, keeps old queue keys valid
+        self.g = {}                # Distance to the goal as of the last expansion of a tile
+        self.rhs = {self.goal: 0}  # Distance to the goal computed from the neighbors of a tile
+        self.queue = []            # Heap of (key, tile), entries whose key differs from self.queued are stale
+        self.queued = {}           # Tile -> key of the tiles that are inconsistent (g != rhs)
+        self.expanded = 0          # Number of tiles expanded by the last call to find_path()
+        self.push(self.goal)
+
+    def heuristic(self, a, b):
+        """ Manhattan distance, the Ai can only move between bordering tiles. """
+        ay, ax = divmod(a, self.current_map.width)
+        by, bx = divmod(b, self.current_map.width)
+        return abs(ax - bx) + abs(ay - by)
+
+    def cost(self, tile):
+        """ Cost of driving into tile. """
+        return 1 if self.current_map.flags[tile] & self.mask else math.inf
+
+    def neighbors(self, tile):
+        """ Returns the tiles of the map bordering tile. """
+        return self.current_map.neighbor_indices[tile]
+
+    def key(self, tile):
+        best = min(self.g.get(tile, math.inf), self.rhs.get(tile, math.inf))
+        return best + self.heuristic(self.start, tile) + self.km, best
+
+    def push(self, tile):
+        key = self.key(tile)
+        self.queued[tile] = key
+        heapq.heappush(self.queue, (key, tile))
+
+    def top_key(self):
+        """ Returns the smallest key in the queue, after dropping stale entries. """
+        while self.queue and self.queued.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        return self.queue[0][0] if self.queue else (math.inf, math.inf)
+
+    def update_vertex(self, tile):
+        """ Recomputes the rhs value of tile and queues it if it has become inconsistent. """
+        if tile != self.goal:
+            self.rhs[tile] = min((self.cost(neighbor) + self.g.get(neighbor, math.inf) for neighbor in self.neighbors(tile)),
+                                 default=math.inf)
+        self.queued.pop(tile, None)
+        if self.g.get(tile, math.inf) != self.rhs.get(tile, math.inf):
+            self.push(tile)
+
+    def compute_shortest_path(self):
+        """ Expands tiles until the distance from the start to the goal is known. """
+        while self.top_key() < self.key(self.start) or self.rhs.get(self.start, math.inf) != self.g.get(self.start, math.inf):
+            old_key, tile = heapq.heappop(self.queue)
+            del self.queued[tile]
+            self.expanded += 1
+
+            new_key = self.key(tile)
+            g = self.g.get(tile, math.inf)
+            rhs = self.rhs.get(tile, math.inf)
+            if old_key < new_key:
+                self.push(tile)
+            elif g > rhs:
+                self.g[tile] = rhs
+                for neighbor in self.neighbors(tile):
+                    self.update_vertex(neighbor)
+            else:
+                self.g[tile] = math.inf
+                self.update_vertex(tile)
+                for neighbor in self.neighbors(tile):
+                    self.update_vertex(neighbor)
+
+    def move_start(self, start):
+        """ Call this when the Ai has moved to another tile (integer coordinates). """
+        start = self.current_map.index(*start)
+        self.km += self.heuristic(self.start, start)
+        self.start = start
+
+    def move_goal(self, goal):
+        """ Call this when the target has moved to another tile (integer coordinates). """
+        goal = self.current_map.index(*goal)
+        if goal == self.goal:
+            return
+        old_goal = self.goal
+        self.goal = goal
+        self.update_vertex(old_goal)
+        self.rhs[goal] = 0
+        self.update_vertex(goal)
+
+    def find_path(self):
+        """ Repairs the search and returns the shortest path from the start to the goal as a deque
+            of tile centres (Vec2d), empty if the goal cannot be reached. The number of tiles
+            expanded by the repair is left in self.expanded. """
+        self.expanded = 0
+        self.compute_shortest_path()
+
+        tile = self.start
+        x, y = self.current_map.tile(tile)
+        path = deque([Vec2d(x + 0.5, y + 0.5)])
+        if self.g.get(tile, math.inf) == math.inf and tile != self.goal:
+            return deque()
+
+        # Follow the neighbors closest to the goal, a path can not be longer than the number of tiles
+        for _ in range(len(self.current_map.flags)):
+            if tile == self.goal:
+                return path
+            tile = min(self.neighbors(tile), key=lambda neighbor: self.cost(neighbor) + self.g.get(neighbor, math.inf))
+            x, y = self.current_map.tile(tile)
+            path.append(Vec2d(x + 0.5, y + 0.5))
+        return deque()
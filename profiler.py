@@ -0,0 +1,154 @@
+""" Timing of the phases of a frame (events, ticks of the simulation, rendering, fog, flip).
+    The durations of the last frames are shown on screen, and every phase can be written to
+    a Chrome trace (chrome://tracing or https://ui.perfetto.dev) to find what made a frame slow.
+"""
+import contextlib
+import json
+import os
+import time
+from collections import deque
+
+import pygame
+
+# Returned by a disabled profiler, entering it costs nothing
+NO_PHASE = contextlib.nullcontext()
+
+OVERLAY_BACKGROUND = (0, 0, 0)
+OVERLAY_COLOR = (255, 255, 255)
+
+
+def percentile(ordered, fraction):
+    """ Returns the value below which fraction of the sorted values are (nearest rank). """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Phase:
+    """ Context manager timing one phase, see Profiler.phase(). """
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.enter(self.name)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    """ Adds up the time spent in every phase during a frame. Phases can be nested, a phase
+        entered several times in a frame (a tick when the simulation catches up) counts once
+        with the sum of its durations. """
+
+    def __init__(self, enabled=False, window=250, trace=False, max_events=1000000):
+        """ Takes whether phases are timed from the start, the number of frames the percentiles
+            are computed over, whether every phase is kept for a Chrome trace and the number
+            of trace events kept at most. """
+        self.enabled = enabled
+        self.window = window
+        self.events = [] if trace else None
+        self.max_events = max_events
+        self.origin = time.perf_counter_ns()
+        self.frame_start = self.origin
+
+        self.stack = []                # Names of the phases being timed, innermost last
+        self.children = {"frame": []}  # Name of a phase -> names of the phases first seen in it, in that order
+        self.current = {}     # Name of a phase -> nanoseconds spent in it during the current frame
+        self.durations = {}   # Name of a phase -> milliseconds spent in it during the last frames
+        self.frames = 0
+
+        self.overlay = None
+        self.font = None
+
+    def phase(self, name):
+        """ Returns a context manager timing the code run in it as the phase name. """
+        if not self.enabled:
+            return NO_PHASE
+        return Phase(self, name)
+
+    def enter(self, name):
+        """ Is called when a phase starts, a phase seen for the first time is put under the phase it runs in. """
+        if name not in self.children:
+            self.children[self.stack[-1] if self.stack else "frame"].append(name)
+            self.children[name] = []
+            # The frames before the phase was seen did not spend time in it
+            self.durations[name] = deque([0.0] * len(self.durations.get("frame", ())), maxlen=self.window)
+        self.stack.append(name)
+
+    def add(self, name, start, end):
+        """ Adds a phase that ran from start to end (time.perf_counter_ns()) to the current frame. """
+        self.stack.pop()
+        self.current[name] = self.current.get(name, 0) + end - start
+
+        if self.events is not None and len(self.events) < self.max_events:
+            self.events.append({"name": name, "ph": "X", "ts": (start - self.origin) / 1000,
+                                "dur": (end - start) / 1000, "pid": os.getpid(), "tid": 0})
+
+    def end_frame(self):
+        """ Call this at the end of every frame, the times of the phases are then added to their history. """
+        now = time.perf_counter_ns()
+        if not self.enabled:
+            self.frame_start = now
+            return
+
+        self.durations.setdefault("frame", deque(maxlen=self.window)).append((now - self.frame_start) / 1e6)
+        for name, durations in self.durations.items():
+            if name != "frame":
+                durations.append(self.current.get(name, 0) / 1e6)
+        if self.events is not None and len(self.events) < self.max_events:
+            self.events.append({"name": "frame", "ph": "i", "s": "p", "ts": (now - self.origin) / 1000,
+                                "pid": os.getpid(), "tid": 0})
+
+        self.current.clear()
+        self.frame_start = now
+        self.frames += 1
+
+    def summary(self):
+        """ Returns a row (name, depth, p50, p95, p99, max) of milliseconds for the frame and every phase. """
+        rows = []
+        # Every phase comes after the phase it runs in
+        pending = [("frame", 0)]
+        while pending:
+            name, depth = pending.pop()
+            ordered = sorted(self.durations.get(name, ()))
+            rows.append((name, depth, percentile(ordered, 0.5), percentile(ordered, 0.95),
+                         percentile(ordered, 0.99), ordered[-1] if ordered else 0.0))
+            pending.extend((child, depth + 1) for child in reversed(self.children[name]))
+        return rows
+
+    def draw(self, surface, refresh=10):
+        """ Draws the percentiles of the phases in the top left corner of surface, the text is
+            only rendered again every refresh frames. Returns the rectangle drawn. """
+        if self.overlay is None or self.frames % refresh == 0:
+            if self.font is None:
+                self.font = pygame.font.Font(None, 18)
+            rows = [("ms", "p50", "p95", "p99", "max")]
+            rows += [("  " * depth + name,) + tuple("%.2f" % value for value in values)
+                     for name, depth, *values in self.summary()]
+            cells = [[self.font.render(cell, True, OVERLAY_COLOR) for cell in row] for row in rows]
+
+            # The font is not monospaced, so every column is as wide as its widest cell
+            widths = [max(row[i].get_width() for row in cells) + 8 for i in range(len(rows[0]))]
+            height = self.font.get_linesize()
+            self.overlay = pygame.Surface((sum(widths) + 8, height * len(cells) + 8))
+            self.overlay.fill(OVERLAY_BACKGROUND)
+            for i, row in enumerate(cells):
+                x = 4
+                for j, cell in enumerate(row):
+                    # The name is aligned left, the numbers right
+                    self.overlay.blit(cell, (x if j == 0 else x + widths[j] - cell.get_width(), 4 + i * height))
+                    x += widths[j]
+
+        return surface.blit(self.overlay, (0, 0))
+
+    def write_trace(self, path):
+        """ Writes the phases kept since the start in the Chrome trace event format. """
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.events or [], "displayTimeUnit": "ms"}, file)
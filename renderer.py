@@ -0,0 +1,83 @@
+""" Rendering strategies for the game screen.
+"""
+import images
+import maps
+
+
+def draw_tiles(surface, current_map, area):
+    """ Draws the grass and the rock boxes of the tiles of current_map inside area (a rectangle of
+        the level in pixels) on surface, the top left corner of area going to the top left corner
+        of surface. Rock boxes never move, they are drawn from the tiles of the map. """
+    size = images.TILE_SIZE
+    for y in range(area.top // size, (area.bottom - 1) // size + 1):
+        for x in range(area.left // size, (area.right - 1) // size + 1):
+            position = (x * size - area.x, y * size - area.y)
+            surface.blit(images.grass, position)
+            if current_map.boxAt(x, y) == maps.ROCK:
+                surface.blit(images.rockbox, position)
+
+
+def merge_rects(rects):
+    """ Returns a list of rectangles covering the same area as rects, where overlapping
+        rectangles have been merged into their union. """
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+class DirtyRectRenderer:
+    """ Redraws only the parts of the screen where something changed since the last frame.
+        An object is dirty when its screen rectangle or its rotated sprite differs from the
+        previous frame, both its old and its new rectangle are then restored from the
+        background and every object overlapping them is drawn again. The returned
+        rectangles are meant for pygame.display.update(). """
+
+    def __init__(self):
+        self.drawn = {}           # Object -> (sprite, rect) as drawn in the previous frame
+        self.full_redraw = True   # Set when the whole screen has to be drawn, for instance on the first frame
+
+    def render(self, screen, background, objects, alpha=1.0):
+        """ Draws objects (in the given order) over the background and returns the list of
+            screen rectangles that changed. alpha is passed on to the objects (see GameObject). """
+        drawn = {}
+        for obj in objects:
+            drawn[obj] = obj.screen_sprite(alpha)
+
+        if self.full_redraw:
+            self.full_redraw = False
+            screen.blit(background, (0, 0))
+            for sprite, rect in drawn.values():
+                screen.blit(sprite, rect)
+            self.drawn = drawn
+            return [screen.get_rect()]
+
+        dirty = []
+        for obj, (sprite, rect) in drawn.items():
+            previous = self.drawn.pop(obj, None)
+            if previous is None:
+                dirty.append(rect)
+            elif previous[0] is not sprite or previous[1] != rect:
+                dirty.append(rect)
+                dirty.append(previous[1])
+
+        # What is left was drawn in the previous frame but has disappeared since
+        dirty.extend(rect for sprite, rect in self.drawn.values())
+        self.drawn = drawn
+
+        dirty = merge_rects(dirty)
+        for area in dirty:
+            # Clipping keeps objects overlapping the area from being drawn over unchanged parts of the screen
+            screen.set_clip(area)
+            screen.blit(background, area, area)
+            for sprite, rect in drawn.values():
+                if rect.colliderect(area):
+                    screen.blit(sprite, rect)
+        screen.set_clip(None)
+
+        return dirty
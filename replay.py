@@ -0,0 +1,359 @@
+""" Recording of the commands given to the tanks of a session, and replay of a recording.
+    The simulation is deterministic, so the commands of the players and of the Ai, with the
+    tick before which they were given, are enough to play a match again exactly.
+    Keyframes, snapshots of the whole match taken at regular intervals, let a replay jump to
+    any tick without simulating everything before it.
+"""
+import hashlib
+import itertools
+import mmap
+import struct
+import time
+from bisect import bisect_right
+
+MAGIC = b"CTFR"
+VERSION = 6
+
+# Magic, version, tick rate, number of human players, options and length of the map name
+HEADER = struct.Struct("<4sHHBBB")
+MAP_HASH_SIZE = 8
+
+# Bits of the options, the settings of the session that change how the match plays
+MERGE_ROCKS = 1
+
+# Commands of a tank, the opcode of a command is its index
+COMMANDS = ("accelerate", "decelerate", "stop_moving", "turn_left", "turn_right", "stop_turning", "shoot", "shoot_ai")
+OPCODES = {name: opcode for opcode, name in enumerate(COMMANDS)}
+
+# A record starts with a tag: the opcode of a command, followed by the number of the tank,
+# TICKS, followed by the number of ticks started since the previous record (as a varint),
+# or KEYFRAME, followed by the tick, the size and the snapshot of the session at the end of that tick (see encode_snapshot).
+# END closes the records, it is followed by the keyframe index and the trailer.
+TICKS = 0xFF
+KEYFRAME = 0xFE
+END = 0xFD
+
+# Tick and file offset of a keyframe in the index
+INDEX_ENTRY = struct.Struct("<QQ")
+# Offset of the index, number of keyframes and magic, at the very end of a complete file
+TRAILER = struct.Struct("<QQ4s")
+INDEX_MAGIC = b"CTFI"
+
+# A keyframe holds the snapshot of a session (see GameSession.snapshot()) as fixed size fields:
+# the tick, ticks until the next update, whether the match runs, the winner (-1 for none) and the
+# number of tanks, boxes and bullets, followed by the kills and flag pickups of every tank, then
+# every tank, box and bullet and the flag. A body is its position, velocity, angle and angular velocity.
+SNAPSHOT = struct.Struct("<QIBiHII")
+# In play, body, acceleration, rotation, max speed, ticks since the last shot and whether it has the flag
+TANK = struct.Struct("<B6dbbdqB")
+# Tile it was created on, body and whether it sleeps
+BOX = struct.Struct("<2d6dB")
+# Body, orientation, whether an Ai shot it, speed, shooter (-1 for none) and age
+BULLET = struct.Struct("<6ddBdiq")
+# Position, orientation and whether it is on a tank
+FLAG = struct.Struct("<3dB")
+
+
+def map_hash(current_map):
+    """ Returns a short hash of the boxes, start positions and flag of a map. """
+    digest = hashlib.blake2b(digest_size=MAP_HASH_SIZE)
+    digest.update(struct.pack("<HH", current_map.width, current_map.height))
+    digest.update(bytes(current_map.tiles))
+    # The positions are hashed as doubles, so that a map read from a file hashes like the same map written in Python
+    positions = [value for position in current_map.start_positions for value in position] + list(current_map.flag_position)
+    digest.update(struct.pack("<%dd" % len(positions), *positions))
+    return digest.digest()
+
+
+def flatten_body(state):
+    """ Returns the body state of a snapshot (see GamePhysicsObject.body_state()) as six numbers. """
+    position, velocity, angle, angular_velocity = state
+    return position[0], position[1], velocity[0], velocity[1], angle, angular_velocity
+
+
+def nest_body(values):
+    """ Returns six numbers written by flatten_body() as a body state. """
+    return (values[0], values[1]), (values[2], values[3]), values[4], values[5]
+
+
+def encode_snapshot(snapshot):
+    """ Returns a snapshot of a session as the bytes of a keyframe. """
+    ticks, skip_update, running, winner, kills, flag_pickups, tanks, boxes, bullets, flag = snapshot
+    data = bytearray(SNAPSHOT.pack(ticks, skip_update, running, -1 if winner is None else winner,
+                                   len(tanks), len(boxes), len(bullets)))
+    data += struct.pack("<%dI" % (2 * len(tanks)), *kills, *flag_pickups)
+    for in_play, body, acceleration, rotation, max_speed, frames_since_last_shoot, has_flag in tanks:
+        data += TANK.pack(in_play, *flatten_body(body), acceleration, rotation, max_speed, frames_since_last_shoot, has_flag)
+    for x, y, body, sleeping in boxes:
+        data += BOX.pack(x, y, *flatten_body(body), sleeping)
+    for body, orientation, is_ai_tank, speed, shooter, age in bullets:
+        data += BULLET.pack(*flatten_body(body), orientation, is_ai_tank, speed, -1 if shooter is None else shooter, age)
+    data += FLAG.pack(*flag)
+    return bytes(data)
+
+
+def decode_snapshot(data):
+    """ Returns the snapshot in the bytes of a keyframe, raises ValueError if they are not one. """
+    try:
+        ticks, skip_update, running, winner, tank_count, box_count, bullet_count = SNAPSHOT.unpack_from(data)
+        offset = SNAPSHOT.size
+        scores = struct.unpack_from("<%dI" % (2 * tank_count), data, offset)
+        offset += 4 * 2 * tank_count
+
+        tanks = []
+        for _ in range(tank_count):
+            values = TANK.unpack_from(data, offset)
+            offset += TANK.size
+            tanks.append((bool(values[0]), nest_body(values[1:7]), values[7], values[8], values[9], values[10], bool(values[11])))
+        boxes = []
+        for _ in range(box_count):
+            values = BOX.unpack_from(data, offset)
+            offset += BOX.size
+            boxes.append((values[0], values[1], nest_body(values[2:8]), bool(values[8])))
+        bullets = []
+        for _ in range(bullet_count):
+            values = BULLET.unpack_from(data, offset)
+            offset += BULLET.size
+            bullets.append((nest_body(values[:6]), values[6], bool(values[7]), values[8],
+                            None if values[9] < 0 else values[9], values[10]))
+        x, y, orientation, is_on_tank = FLAG.unpack_from(data, offset)
+        offset += FLAG.size
+    except struct.error:
+        raise ValueError("the keyframe is cut or damaged")
+    if offset != len(data):
+        raise ValueError("the keyframe is cut or damaged")
+
+    return (ticks, skip_update, bool(running), None if winner < 0 else winner,
+            list(scores[:tank_count]), list(scores[tank_count:]), tanks, boxes, bullets, (x, y, orientation, bool(is_on_tank)))
+
+
+def write_varint(buffer, value):
+    """ Appends value to buffer in 7 bit groups, the high bit is set on every byte but the last. """
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, offset):
+    """ Returns the value written by write_varint() at offset in data and the offset after it. """
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, offset
+
+
+class Recorder:
+    """ Writes the commands given to the tanks of a session to a binary file. Ticks without
+        commands are grouped in one record, so an idle match costs almost nothing. """
+
+    FLUSH_SIZE = 1 << 16
+
+    def __init__(self, file, map_name, current_map, tick_rate, human_players, keyframe_interval=500, merge_rocks=False):
+        """ Takes a file opened for binary writing, the settings of the session to record and
+            the number of ticks between two keyframes. """
+        self.file = file
+        self.buffer = bytearray()
+        self.pending_ticks = 0
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = []   # (tick, file offset) of every keyframe written
+        self.commands = 0     # Number of commands recorded
+
+        name = map_name.encode()
+        options = MERGE_ROCKS if merge_rocks else 0
+        self.file.write(HEADER.pack(MAGIC, VERSION, tick_rate, human_players, options, len(name)))
+        self.file.write(name)
+        self.file.write(map_hash(current_map))
+        self.written = HEADER.size + len(name) + MAP_HASH_SIZE
+
+    def tick(self):
+        """ Call this before every tick of the session. """
+        self.pending_ticks += 1
+
+    def write_ticks(self):
+        if self.pending_ticks:
+            self.buffer.append(TICKS)
+            write_varint(self.buffer, self.pending_ticks)
+            self.pending_ticks = 0
+
+    def wants_keyframe(self, tick):
+        """ Returns True if a keyframe should be taken at the end of tick. """
+        return tick % self.keyframe_interval == 0
+
+    def keyframe(self, tick, snapshot):
+        """ Records the snapshot of the session taken at the end of tick. """
+        self.write_ticks()
+        self.keyframes.append((tick, self.written + len(self.buffer)))
+        data = encode_snapshot(snapshot)
+        self.buffer.append(KEYFRAME)
+        write_varint(self.buffer, tick)
+        write_varint(self.buffer, len(data))
+        self.buffer += data
+        if len(self.buffer) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def command(self, tank_number, name):
+        """ Records a command (see COMMANDS) given to a tank before the next tick. """
+        self.write_ticks()
+        self.buffer.append(OPCODES[name])
+        self.buffer.append(tank_number)
+        self.commands += 1
+
+        if len(self.buffer) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.written += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        """ Writes the ticks and commands not written yet and the keyframe index, and closes the file. """
+        self.write_ticks()
+        self.buffer.append(END)
+        index_offset = self.written + len(self.buffer)
+        for tick, offset in self.keyframes:
+            self.buffer += INDEX_ENTRY.pack(tick, offset)
+        self.buffer += TRAILER.pack(index_offset, len(self.keyframes), INDEX_MAGIC)
+        self.flush()
+        self.file.close()
+
+
+class Replay:
+    """ A recording read back from a file. The settings of the recorded session are in
+        map_name, tick_rate, human_players and merge_rocks. """
+
+    def __init__(self, data):
+        """ Takes the content of a file written by a Recorder, as bytes or memory-mapped. """
+        magic, version, self.tick_rate, self.human_players, options, name_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a replay file")
+        if version != VERSION:
+            raise ValueError("replay version %d is not supported" % version)
+        self.merge_rocks = bool(options & MERGE_ROCKS)
+
+        offset = HEADER.size
+        self.map_name = bytes(data[offset:offset + name_length]).decode()
+        offset += name_length
+        self.map_hash = bytes(data[offset:offset + MAP_HASH_SIZE])
+        self.data = data
+        self.start = offset + MAP_HASH_SIZE
+        self.keyframes = self.read_index()   # (tick, file offset) of the keyframes, by tick
+
+    @classmethod
+    def load(cls, path):
+        """ Maps the file in memory, only the parts that are read are loaded from the disk. """
+        with open(path, "rb") as file:
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def read_index(self):
+        """ Returns the keyframe index from the end of the file. A file that was not closed
+            (the game crashed) has no index, its records are then scanned for the keyframes. """
+        data = self.data
+        if len(data) >= self.start + TRAILER.size:
+            index_offset, count, magic = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+            if magic == INDEX_MAGIC:
+                return [INDEX_ENTRY.unpack_from(data, index_offset + i * INDEX_ENTRY.size) for i in range(count)]
+
+        return [(value, offset) for record, value, offset in self.records() if record == KEYFRAME]
+
+    def check_map(self, current_map):
+        """ Raises ValueError if current_map is not the map the replay was recorded on. """
+        if map_hash(current_map) != self.map_hash:
+            raise ValueError("the replay was recorded on another version of %s" % self.map_name)
+
+    def records(self, offset=None):
+        """ Yields the records from offset (the first one by default) in order, as
+            (TICKS, number of ticks, offset), (KEYFRAME, tick, offset) or (command name, tank number, offset),
+            where offset is the position of the record in the file. """
+        data = self.data
+        offset = self.start if offset is None else offset
+        try:
+            while offset < len(data):
+                record_offset = offset
+                tag = data[offset]
+                offset += 1
+                if tag == END:
+                    return
+                if tag == TICKS:
+                    value, offset = read_varint(data, offset)
+                    yield TICKS, value, record_offset
+                elif tag == KEYFRAME:
+                    value, offset = read_varint(data, offset)
+                    size, offset = read_varint(data, offset)
+                    offset += size
+                    if offset > len(data):
+                        return
+                    yield KEYFRAME, value, record_offset
+                else:
+                    tank = data[offset]
+                    offset += 1
+                    yield COMMANDS[tag], tank, record_offset
+        except IndexError:
+            # The last record of a file that was not closed (the game crashed) may be cut
+            return
+
+    def keyframe(self, offset):
+        """ Returns the tick and the snapshot of the keyframe record at offset, and the offset of the next record. """
+        tick, position = read_varint(self.data, offset + 1)
+        size, position = read_varint(self.data, position)
+        return tick, decode_snapshot(self.data[position:position + size]), position + size
+
+    def ticks(self, session, offset=None, restore_keyframes=False):
+        """ Gives the commands of the records from offset (the first one by default) to session,
+            and yields every time a recorded tick has to be run. With restore_keyframes, session
+            is also brought to every keyframe it passes (see seek()). """
+        for record, value, record_offset in self.records(offset):
+            if record == TICKS:
+                for _ in range(value):
+                    yield
+            elif record == KEYFRAME:
+                if restore_keyframes:
+                    session.restore(self.keyframe(record_offset)[1])
+            else:
+                session.apply_command(value, record)
+
+    def run(self, session, ticks, max_ticks=None):
+        """ Steps session for every tick yielded by ticks (see ticks()), until max_ticks or the end
+            of the match. Returns the ticks left, to go on from there. """
+        for _ in ticks:
+            if not session.running or (max_ticks is not None and session.ticks >= max_ticks):
+                # The tick was taken but not run, it is put back in front of the others
+                return itertools.chain((None,), ticks)
+            session.step()
+            # Like GameSession.run(), every tick is profiled as a frame
+            session.profiler.end_frame()
+        return ticks
+
+    def play(self, session, max_ticks=None, ticks=None):
+        """ Runs the recorded commands through session (created with the settings of the replay)
+            as fast as possible, from the beginning or from the ticks left by seek().
+            Returns the elapsed wall time in seconds. """
+        self.check_map(session.current_map)
+        session.replaying = True
+        start_time = time.perf_counter()
+        self.run(session, self.ticks(session) if ticks is None else ticks, max_ticks)
+        return time.perf_counter() - start_time
+
+    def seek(self, session, tick):
+        """ Brings a new session, created with the settings of the replay, to the end of tick: the
+            last keyframe before it is restored and only the records after the keyframe are played.
+            Returns the ticks left, for play() to go on from there.
+            The contacts cached by pymunk between two steps and the time a box has been idle are
+            not part of a snapshot, so after a keyframe the bodies may drift slightly from the
+            recorded match. The ticks left restore every keyframe they pass, so the drift never
+            builds up over more than the ticks between two keyframes. """
+        self.check_map(session.current_map)
+        session.replaying = True
+
+        offset = None
+        i = bisect_right(self.keyframes, (tick, float("inf")))
+        if i > 0:
+            _, snapshot, offset = self.keyframe(self.keyframes[i - 1][1])
+            session.restore(snapshot)
+
+        return self.run(session, self.ticks(session, offset, restore_keyframes=True), tick)
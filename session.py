@@ -0,0 +1,722 @@
+""" This module contains the GameSession, which holds everything that belongs to one match.
+    pygame needs a display mode before this module is imported, since it loads the images.
+"""
+import time
+
+import pygame
+import pymunk
+
+import ai
+import fog
+import gameobjects
+import images
+import maps
+import pathfinding
+import profiler
+import renderer
+import replay
+import sounds
+import spatial
+import viewport
+
+
+# Dictionary of all collision types
+collision_types = {
+    "bullet": 1,
+    "tank": 2,
+    "stone": 3,
+    "wood": 4,
+    "metal": 5,
+    "bounds": 6
+}
+
+
+class GameSession:
+    """ One match on one map. A session owns its pymunk space, its game objects and its Ai,
+        so several sessions can run side by side in the same interpreter.
+        step() advances the match by one tick and render(surface) draws it. advance(seconds)
+        runs the ticks of a fixed timestep simulation that fit in a frame of real time. """
+
+    FRAMERATE = 50          # Frames drawn per second
+    TICK_RATE = 50          # Ticks per second the speeds and accelerations of the game objects were tuned for
+    UPDATE_INTERVAL = 0.06  # Seconds between two updates of the game objects other than tanks and bullets
+    RELOAD_TIME = 1.0       # Seconds between two shots of a tank
+    MAX_CATCH_UP = 5        # Ticks run at most by advance(), a slower machine gets a slower game instead of freezing
+    SLEEP_TIME = 0.5        # Seconds a box stays idle before it falls asleep
+    IDLE_SPEED = 0.05       # Speed, in tiles per second, under which a box counts as idle
+
+    def __init__(self, current_map, human_players=1, headless=False, audio=None, dirty_rects=False, play_FOW=False,
+                 tick_rate=TICK_RATE, merge_rocks=False):
+        """ Takes the map to play on, the number of tanks controlled by players (the first ones,
+            the others are controlled by the Ai), whether the match runs headless (without
+            explosions and sound), the audio bank playing the sounds, whether only the changed
+            parts of the screen are redrawn, whether fog of war is on, the number of ticks
+            simulated per second of game time and whether adjacent rock boxes are merged into
+            larger shapes in the physics engine (see create_rock_walls). """
+        self.current_map = current_map
+        self.merge_rocks = merge_rocks
+        self.human_players = human_players
+        self.headless = headless
+        self.audio = audio if audio is not None else sounds.NullAudio()
+        self.play_FOW = play_FOW
+
+        # -- Timing, the durations of the game are converted to ticks of this session
+        self.tick_rate = tick_rate
+        self.tick_time = 1 / tick_rate
+        self.time_scale = self.TICK_RATE / tick_rate
+        self.update_period = self.ticks_for(self.UPDATE_INTERVAL)
+        self.reload_ticks = self.ticks_for(self.RELOAD_TIME)
+        self.accumulator = 0.0  # Real time not simulated yet, in seconds
+
+        # -- Initialise the physics engine
+        self.space = pymunk.Space()
+        self.space.gravity = (0.0, 0.0)
+        self.space.damping = 0.1  # Adds friction to the ground for all objects
+        # Idle boxes fall asleep, pymunk then leaves them out of the steps until something touches them.
+        # The damping never brings a box to a complete stop, so the idle speed cannot be left to pymunk
+        self.space.sleep_time_threshold = self.SLEEP_TIME
+        self.space.idle_speed_threshold = self.IDLE_SPEED
+
+        # Bullets are reused, the bullets in flight are in self.bullets.active
+        self.bullets = gameobjects.BulletPool(self.space, self.ticks_for(gameobjects.BulletPool.MAX_AGE / self.TICK_RATE))
+
+        #   List of all game objects
+        self.game_objects_list = []
+        self.active_objects = []   # Objects of game_objects_list with logic run every tick, the boxes are left to pymunk
+        self.moved_boxes = set()   # Boxes moved by pymunk during the last tick, their state is kept before the next one (see save_previous)
+        self.bases_list = []
+        self.tanks_list = []
+        self.numbered_tanks = []
+        self.tanks = []   # Every tank by number, in play or destroyed, a tank keeps its object when it respawns
+        self.boxes = []   # Every box that can move or be destroyed, in the order they were created
+        self.ai_list = []
+        self.explosion_list = []
+
+        # Shortest paths of the Ai, shared so that a target is only searched once
+        self.path_finder = pathfinding.PathFinder(current_map)
+
+        # Raycasts of the Ai, an Ai asks twice for its line of fire during a tick
+        self.query_cache = spatial.QueryCache(self.space)
+
+        # Collision callbacks, keyed by the pair of collision types they handle (see add_collision_handler)
+        self.collision_handlers = {}
+
+        # The background is only created when the session is rendered for the first time, rock boxes
+        # and bases never change so it is never drawn again
+        self.background = None
+        self.background_chunks = None   # viewport.BackgroundChunks, for levels seen through a camera
+        self.fog = None
+
+        # Redraws only what changed (fog of war covers the whole screen, so it needs full redraws)
+        self.dirty_renderer = renderer.DirtyRectRenderer() if dirty_rects and not play_FOW else None
+
+        # Times the phases of the ticks and of the rendering, disabled until a profile is asked for
+        self.profiler = profiler.Profiler()
+
+        # -- Recording and replay of the commands given to the tanks
+        self.recorder = None     # replay.Recorder, see start_recording()
+        self.replaying = False   # Set by replay.Replay.play(), the commands then come from the replay instead of the Ai
+
+        # -- Match state
+        self.running = True
+        self.skip_update = 0
+        self.ticks = 0
+        self.winner = None
+
+        # -- Match statistics, indexed by tank number
+        self.kills = [0] * len(current_map.start_positions)
+        self.flag_pickups = [0] * len(current_map.start_positions)
+
+        # Create the flag
+        self.flag = gameobjects.Flag(current_map.flag_position[0], current_map.flag_position[1])
+        self.game_objects_list.append(self.flag)
+        self.active_objects.append(self.flag)
+
+        self.create_boxes()
+
+        self.create_tanks()
+
+        # Create numbered list where numbers correspond to tank in tank_list (Used incollision detection)
+        # Creates after tanks_list is defined in function create_tanks
+        self.numbered_tanks = list(range(len(self.tanks_list)))
+
+        self.create_bases()
+
+        self.create_bounds()
+
+        self.collision_detection()
+
+        # Respawns put the tanks back in their start state instead of creating them again
+        self.start_states = [self.tank_state(tank) for tank in self.tanks]
+
+    def tank_number(self, tank):
+        """ Returns the number of a tank, which is the index of its start position in the current map """
+        for i, pos in enumerate(self.current_map.start_positions):
+            if tank.start_position == (pos[0], pos[1]):
+                return i
+        return None
+
+    # -- Level creation
+    def create_background(self):
+        """Copy the grass tile all over the level area, then draw the static layer (rock boxes
+        and bases) on top of it, so that it does not need to be drawn every frame.
+        The rock boxes are drawn from the tiles of the map, they may be merged in the physics engine"""
+        if self.background is None:
+            self.background = pygame.Surface(self.current_map.rect().size)
+
+        renderer.draw_tiles(self.background, self.current_map, self.current_map.rect())
+
+        for obj in self.bases_list:
+            obj.update_screen(self.background)
+
+    def create_boxes(self):
+        """Create the boxes"""
+        for x in range(0, self.current_map.width):
+            for y in range(0, self.current_map.height):
+                # Get the type of boxes
+                box_type = self.current_map.boxAt(x, y)
+                # If the box type is not 0 (aka grass tile), create a box, merged rock boxes are created afterwards
+                if box_type != 0 and not (self.merge_rocks and box_type == maps.ROCK):
+                    # Create a "Box" using the box_type, aswell as the x,y coordinates,
+                    # and the pymunk space
+                    box = gameobjects.get_box_with_type(x, y, box_type, self.space)
+                    # Rock boxes never move, they are part of the background and only live in the space
+                    if box.body.body_type != pymunk.Body.STATIC:
+                        self.game_objects_list.append(box)
+                        self.boxes.append(box)
+                        # Nothing is drawn between two ticks of a headless match, the moved boxes are not needed
+                        if not self.headless:
+                            self.track_box(box)
+
+        if self.merge_rocks:
+            self.create_rock_walls()
+
+    def track_box(self, box):
+        """Makes pymunk add the box to self.moved_boxes at every tick it is awake. A new box is awake
+        until it has been idle for SLEEP_TIME"""
+        moved_boxes = self.moved_boxes
+
+        def update_position(body, dt):
+            pymunk.Body.update_position(body, dt)
+            moved_boxes.add(box)
+
+        box.body.position_func = update_position
+        moved_boxes.add(box)
+
+    def create_rock_walls(self):
+        """Adds the rock boxes to the physics engine as a few large rectangles on the static body of
+        the space instead of one body and shape per box, which keeps walls out of the broadphase.
+        Tanks and bullets collide with them like with rock boxes, and the Ai see them as walls"""
+        static_body = self.space.static_body
+        walls = []
+        for x, y, width, height in self.current_map.rectangles(maps.ROCK):
+            wall = pymunk.Poly(static_body, [(x, y), (x, y + height), (x + width, y + height), (x + width, y)])
+            wall.collision_type = collision_types["stone"]
+            walls.append(wall)
+        self.space.add(*walls)
+
+    def create_tanks(self):
+        """Create the tanks"""
+
+        # Loop over the starting poistion
+        for i in range(0, len(self.current_map.start_positions)):
+
+            # Get the starting position of the tank "i"
+            pos = self.current_map.start_positions[i]
+
+            # Create the tank, images.tanks contains the image representing the tank, the colors repeat on maps with more tanks
+            tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[i % len(images.tanks)], self.space)
+            tank.command_listener = self.record_command
+            self.tanks_list.append(tank)
+            self.tanks.append(tank)
+
+            if i >= self.human_players:
+                artificial_intelligence = ai.Ai(tank, self.game_objects_list, self.tanks_list, self.space,
+                                                self.current_map, self.path_finder, self.query_cache)
+                self.ai_list.append(artificial_intelligence)
+
+    def create_bases(self):
+        """Create the bases"""
+        for i in range(0, len(self.current_map.start_positions)):
+            pos = self.current_map.start_positions[i]
+            base = gameobjects.GameVisibleObject(pos[0], pos[1], images.bases[i % len(images.bases)])
+            self.bases_list.append(base)
+
+    def create_bounds(self):
+        """Adds outer lines to prevent tanks from going out of bounds"""
+        x_bound = self.current_map.width
+        y_bound = self.current_map.height
+        static_body = self.space.static_body
+        static_lines = [
+            pymunk.Segment(static_body, (0, 0), (0, y_bound), 0.0),
+            pymunk.Segment(static_body, (0, 0), (x_bound, 0), 0.0),
+            pymunk.Segment(static_body, (x_bound, y_bound), (0, y_bound), 0.0),
+            pymunk.Segment(static_body, (x_bound, y_bound), (x_bound, 0), 0.0),
+        ]
+        for line in static_lines:
+            line.collision_type = collision_types["bounds"]
+            line.elasticity = 0
+            line.friction = 1
+
+        self.space.add(*static_lines)
+
+    def create_explosion(self, bullet):
+        """creates an explosion"""
+
+        # Explosions are only visual and audible, a headless match has no use for them
+        if self.headless:
+            return
+
+        exp = gameobjects.Explosion(bullet.x, bullet.y)
+        self.explosion_list.append(exp)
+
+        # Plays the preloaded explosion sound, this is called from the physics engine and must not touch the disk
+        self.audio.play("explosion")
+
+    # -- Shooting and respawning
+    def fire(self, tank, is_ai_tank=False):
+        """Shoots a bullet from tank, credited to the tank for the kills"""
+        bullet = tank.shoot(self.bullets, is_ai_tank)
+        bullet.shooter = self.tank_number(tank)
+        tank.frames_since_last_shoot = 0
+        if self.recorder is not None:
+            self.recorder.command(bullet.shooter, "shoot_ai" if is_ai_tank else "shoot")
+
+    def player_shoot(self, player):
+        """Shoots with the tank of a player if it has reloaded"""
+        tank = self.tanks_list[player]
+        if tank.frames_since_last_shoot > self.reload_ticks:
+            self.fire(tank)
+
+    def ai_shoot(self, ai_tank, pos):
+        """ Shoot function for the Ai """
+        if ai_tank.tank.frames_since_last_shoot > self.reload_ticks:
+            if ai_tank.maybe_shoot(pos):
+                self.fire(ai_tank.tank, True)
+
+    # -- Recording and replay
+    def start_recording(self, file, keyframe_interval=500):
+        """Records the commands given to the tanks from now on into file (opened for binary writing),
+        with a snapshot of the match every keyframe_interval ticks. Call stop_recording() at the end of the match"""
+        self.recorder = replay.Recorder(file, self.current_map.name, self.current_map, self.tick_rate,
+                                        self.human_players, keyframe_interval, self.merge_rocks)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def record_command(self, tank, name):
+        """Is called by the tanks for every command they get"""
+        if self.recorder is not None:
+            self.recorder.command(self.tank_number(tank), name)
+
+    def apply_command(self, number, name):
+        """Gives a recorded command (see replay.COMMANDS) to the tank with a number. A destroyed
+        tank keeps getting commands from its Ai until it respawns"""
+        tank = self.tanks[number]
+        if name == "shoot" or name == "shoot_ai":
+            self.fire(tank, name == "shoot_ai")
+        else:
+            getattr(tank, name)()
+
+    def tank_destroyed(self):
+        """Checks if any tanks have been destroyed"""
+        for tank_num in range(0, len(self.current_map.start_positions)):
+            if tank_num not in self.numbered_tanks:
+
+                # Puts flag down
+                if self.flag.is_on_tank:
+                    self.flag.is_on_tank = False
+
+                # Reset tanks to start position, the tank and its body are put back as they were at the start of the match
+                self.numbered_tanks.insert(tank_num, tank_num)
+                tank = self.tanks[tank_num]
+                self.restore_tank(tank, self.start_states[tank_num])
+                self.tanks_list.insert(tank_num, tank)
+
+                # The tanks of the players come first, the index of an Ai is shifted by their number
+                if tank_num >= self.human_players:
+                    self.ai_list[tank_num - self.human_players].reset()
+
+    # -- Collisions
+    def add_collision_handler(self, type_a, type_b, callback):
+        """Makes callback(arb, space, data) the pre_solve function for collisions between shapes
+        of type_a and type_b. The pymunk handler is only created the first time a pair of types
+        is seen, registering another callback for the pair only replaces it in the dispatch table"""
+        pair = (type_a, type_b)
+
+        if pair not in self.collision_handlers:
+            handler = self.space.add_collision_handler(type_a, type_b)
+            handler.data["pair"] = pair
+            handler.pre_solve = self.dispatch_collision
+
+        self.collision_handlers[pair] = callback
+
+    def dispatch_collision(self, arb, space, data):
+        """Calls the callback registered for the collision types of the colliding shapes"""
+        return self.collision_handlers[data["pair"]](arb, space, data)
+
+    def collision_detection(self):
+        """Registers the functions that are called when a bullet collides with objects.
+        Is called once, when the level is created"""
+
+        self.add_collision_handler(collision_types["bullet"], collision_types["tank"], self.collision_bullet_tank)
+        self.add_collision_handler(collision_types["bullet"], collision_types["stone"], self.collision_bullet_remove)
+        self.add_collision_handler(collision_types["bullet"], collision_types["wood"], self.collision_bullet_wood)
+        self.add_collision_handler(collision_types["bullet"], collision_types["metal"], self.collision_bullet_remove)
+        self.add_collision_handler(collision_types["bullet"], collision_types["bounds"], self.collision_bullet_remove)
+
+    def collision_bullet_tank(self, arb, space, data):
+        """Is called when a bullet collides with a tank"""
+
+        # Creates an explosion when a tank collides with a bullet
+        tank = arb.shapes[1].parent
+        self.create_explosion(tank)
+
+        # The tank may already have been hit by another bullet during this step
+        if tank in self.tanks_list:
+            # Delete from both lists
+            index_removed_tank = self.tanks_list.index(tank)
+            del self.numbered_tanks[index_removed_tank]
+            self.tanks_list.remove(tank)
+            self.kills[arb.shapes[0].parent.shooter] += 1
+
+        # Delete bullet
+        self.bullets.release(arb.shapes[0].parent, in_step=True)
+
+        # Delete from physics engine, once if the tank was hit by several bullets
+        space.add_post_step_callback(gameobjects.remove_after_step, tank, arb.shapes[1], arb.shapes[1].body)
+
+        return False
+
+    def collision_bullet_wood(self, arb, space, data):
+        """Is called when a bullet collides with a wood box, both are destroyed"""
+        # Creates an explosion when a bullet collides with a wood box, once per bullet
+        if self.bullets.release(arb.shapes[0].parent, in_step=True):
+            self.create_explosion(arb.shapes[1].parent)
+
+        try:
+            self.game_objects_list.remove(arb.shapes[1].parent)
+            space.add_post_step_callback(gameobjects.remove_after_step, arb.shapes[1].parent, arb.shapes[1], arb.shapes[1].body)
+        except ValueError:
+            pass
+        return True
+
+    def collision_bullet_remove(self, arb, space, data):
+        """Is called when a bullet collides with a stone box, a metal box or the bounds, only the bullet is destroyed"""
+        self.bullets.release(arb.shapes[0].parent, in_step=True)
+        return False
+
+    # -- Simulation
+    def ticks_for(self, seconds):
+        """Returns the number of ticks lasting seconds of game time, at least one"""
+        return max(1, round(seconds * self.tick_rate))
+
+    def save_previous(self):
+        """Keeps the state of the moving objects before a tick, the screen is drawn between it and the next state"""
+        for obj in self.active_objects:
+            obj.save_previous()
+        # The boxes asleep during the last tick have not moved, the state they keep is still their current one
+        for box in self.moved_boxes:
+            box.save_previous()
+        self.moved_boxes.clear()
+        for tank in self.tanks_list:
+            tank.save_previous()
+        for bullet in self.bullets.active:
+            bullet.save_previous()
+
+    def step(self):
+        """Advances the game by one tick: collisions, physics, flag, victory and Ai"""
+        profile = self.profiler.phase
+
+        # Nothing is drawn between two ticks of a headless match
+        if not self.headless:
+            self.save_previous()
+
+        if self.recorder is not None:
+            self.recorder.tick()
+
+        with profile("respawn"):
+            self.tank_destroyed()
+
+        # Tries to constantly grab flag for all tanks
+        with profile("flag"):
+            for tank in self.tanks_list:
+                if not self.flag.is_on_tank:
+                    tank.try_grab_flag(self.flag)
+                    if self.flag.is_on_tank:
+                        self.flag_pickups[self.tank_number(tank)] += 1
+
+        # -- Update physics
+        with profile("update"):
+            if self.skip_update == 0:
+                # Loop over the game objects with logic of their own and update their speed in function of their
+                # acceleration. The boxes are only moved by pymunk, which skips them while they sleep.
+                for obj in self.active_objects:
+                    obj.update()
+                self.skip_update = self.update_period - 1
+            else:
+                self.skip_update -= 1
+
+        #   Check collisions and update the objects position, the collision callbacks run in there
+        with profile("physics"):
+            self.space.step(self.tick_time)
+            self.query_cache.invalidate()
+
+        with profile("post_update"):
+            #   Update object that depends on an other object position (for instance a flag)
+            for obj in self.active_objects:
+                obj.post_update()
+
+            # Update tanks and flag position if on tank
+            for tank in self.tanks_list:
+                tank.update(self.time_scale)
+                tank.post_update()
+                tank.frames_since_last_shoot += 1
+                # Checks if tank has won
+                if tank.has_won():
+                    self.running = False
+                    self.winner = self.tank_number(tank)
+
+            # Update bullet velocities and remove the bullets that have flown for too long
+            for bullet in self.bullets.active:
+                bullet.update(self.time_scale)
+            self.bullets.update()
+
+        # Handles the Ai, in a replay its commands are given by the replay
+        with profile("ai"):
+            for ai_tank in self.ai_list:
+                if not self.replaying:
+                    ai_tank.decide()
+
+                    if ai_tank.maybe_shoot(ai_tank.tank.body.position):
+                        self.ai_shoot(ai_tank, ai_tank.tank.body.position)
+
+                if ai_tank.tank.has_won():
+                    self.running = False
+                    self.winner = self.tank_number(ai_tank.tank)
+
+        self.ticks += 1
+
+        if self.recorder is not None and self.recorder.wants_keyframe(self.ticks):
+            self.recorder.keyframe(self.ticks, self.snapshot())
+
+    def advance(self, elapsed):
+        """Adds elapsed seconds of real time to the simulation and runs every whole tick that
+        fits, at most MAX_CATCH_UP. Returns the fraction of a tick left over, with which the
+        screen is drawn between the last two states"""
+        self.accumulator += elapsed
+        steps = 0
+        while self.running and self.accumulator >= self.tick_time and steps < self.MAX_CATCH_UP:
+            self.step()
+            self.accumulator -= self.tick_time
+            steps += 1
+
+        # After a long frame the time that could not be caught up is dropped
+        if self.accumulator >= self.tick_time:
+            self.accumulator %= self.tick_time
+        return self.accumulator / self.tick_time
+
+    def run(self, max_ticks=None):
+        """Runs the simulation without frame rate cap until a tank has won or
+        max_ticks have passed. Returns the elapsed wall time in seconds"""
+        start_time = time.perf_counter()
+
+        while self.running and (max_ticks is None or self.ticks < max_ticks):
+            self.step()
+            # Without frames, every tick is profiled as a frame
+            self.profiler.end_frame()
+
+        return time.perf_counter() - start_time
+
+    # -- Snapshots
+    def snapshot(self):
+        """Returns the state of the match as plain data (tuples, lists and numbers): the bodies of
+        the tanks, boxes and bullets with what the game keeps about them (whether a box sleeps),
+        the flag and the score.
+        The Ai are not included, restore() starts them again from where their tanks are"""
+        tanks = [self.tank_state(tank) for tank in self.tanks]
+        boxes = [(box.x, box.y, box.body_state(), box.body.is_sleeping) for box in self.boxes if box.body.space is not None]
+        bullets = [(bullet.body_state(), bullet.orientation, bullet.is_ai_tank, bullet.speed, bullet.shooter, bullet.age)
+                   for bullet in self.bullets.active]
+        flag = (self.flag.x, self.flag.y, self.flag.orientation, self.flag.is_on_tank)
+
+        return (self.ticks, self.skip_update, self.running, self.winner, list(self.kills), list(self.flag_pickups),
+                tanks, boxes, bullets, flag)
+
+    def tank_state(self, tank):
+        """Returns the state of a tank in a snapshot: whether it is in play, its body, its controls,
+        its speed limit, the ticks since it last shot and whether it carries the flag"""
+        return (tank.body.space is not None, tank.body_state(), tank.acceleration, tank.rotation,
+                tank.max_speed, tank.frames_since_last_shoot, tank.flag is not None)
+
+    def restore_tank(self, tank, state):
+        """Puts a tank in a state returned by tank_state(), adding its body to the space or removing it.
+        The lists of the tanks in play are left to the caller"""
+        in_play, body_state, tank.acceleration, tank.rotation, tank.max_speed, tank.frames_since_last_shoot, has_flag = state
+        tank.set_body_state(body_state)
+        tank.flag = self.flag if has_flag else None
+        if in_play and tank.body.space is None:
+            self.space.add(tank.body, tank.shape)
+        elif not in_play and tank.body.space is not None:
+            self.space.remove(tank.shape, tank.body)
+
+    def restore(self, snapshot):
+        """Brings the session, new or in play, to the state of a snapshot taken on the same map.
+        The objects of the session are kept, only their state changes: destroyed boxes and tanks
+        are added back to the space, the bullets in flight are returned to the pool and the Ai
+        start again from where their tanks are. What pymunk keeps between two steps (cached contacts,
+        the corrections of overlapping bodies) is not restored, so a session brought back to its
+        initial state does not play the same match as a new one"""
+        (self.ticks, self.skip_update, self.running, self.winner, kills, flag_pickups,
+         tanks, boxes, bullets, flag) = snapshot
+        self.kills[:] = kills
+        self.flag_pickups[:] = flag_pickups
+
+        # The boxes are found by the tile they were created on, those missing from the snapshot have been destroyed
+        box_states = {(x, y): (state, sleeping) for x, y, state, sleeping in boxes}
+        for box in self.boxes:
+            state, _ = box_states.get((box.x, box.y), (None, False))
+            if state is None:
+                if box.body.space is not None:
+                    self.space.remove(box.shape, box.body)
+            else:
+                if box.body.space is None:
+                    self.space.add(box.body, box.shape)
+                # Setting the state of a body wakes it up
+                box.set_body_state(state)
+        # The lists are shared with the Ai, so they are changed in place
+        self.game_objects_list[:] = [self.flag] + [box for box in self.boxes if box.body.space is not None]
+
+        self.flag.x, self.flag.y, self.flag.orientation, self.flag.is_on_tank = flag
+
+        for tank, state in zip(self.tanks, tanks):
+            self.restore_tank(tank, state)
+        self.tanks_list[:] = [tank for tank in self.tanks if tank.body.space is not None]
+        self.numbered_tanks[:] = [number for number, tank in enumerate(self.tanks) if tank.body.space is not None]
+
+        for bullet in list(self.bullets.active):
+            self.bullets.release(bullet)
+        for body_state, orientation, is_ai_tank, speed, shooter, age in bullets:
+            bullet = self.bullets.acquire(body_state[0][0], body_state[0][1], 0, is_ai_tank)
+            bullet.set_body_state(body_state)
+            bullet.orientation = orientation
+            bullet.speed = speed
+            bullet.shooter = shooter
+            bullet.age = age
+
+        # The boxes asleep in the snapshot go back to sleep once every body is in place. In a session
+        # in play, a box still has the contacts of the last step, and chipmunk corrupts its memory when
+        # two touching boxes are put to sleep one by one, so the box is added again without contacts
+        for box in self.boxes:
+            if box_states.get((box.x, box.y), (None, False))[1]:
+                self.space.remove(box.shape, box.body)
+                self.space.add(box.body, box.shape)
+                box.body.sleep()
+
+        self.explosion_list.clear()
+        self.query_cache.invalidate()
+        for artificial_intelligence in self.ai_list:
+            artificial_intelligence.reset()
+
+    # -- Rendering
+    def render(self, surface, alpha=1.0, camera=None):
+        """Draws the game on surface, alpha of a tick between the previous and the current state
+        (see advance). Returns the list of changed rectangles when only those were redrawn,
+        None when the entire surface was. With a viewport.Camera, only the part of the level
+        inside the camera is drawn (see render_view)"""
+        if camera is not None:
+            return self.render_view(surface, alpha, camera)
+
+        if self.background is None:
+            self.create_background()
+            if self.dirty_renderer is not None:
+                self.dirty_renderer.full_redraw = True
+
+        if self.dirty_renderer is not None:
+            objects = self.game_objects_list + self.tanks_list + self.bullets.active + self.explosion_list
+            rects = self.dirty_renderer.render(surface, self.background, objects, alpha)
+
+            # Like with full redraws, explosions are removed once they have been displayed
+            self.explosion_list.clear()
+            return rects
+
+        # Display the background on the screen
+        surface.blit(self.background, (0, 0))
+
+        # Update the display of the game objects on the screen
+        for obj in self.game_objects_list:
+            obj.update_screen(surface, alpha)
+
+        for tank in self.tanks_list:
+            tank.update_screen(surface, alpha)
+
+        for bullet in self.bullets.active:
+            bullet.update_screen(surface, alpha)
+
+        # Displays the explosions, they are removed once they have been displayed
+        for exp in self.explosion_list:
+            exp.update_screen(surface)
+        self.explosion_list.clear()
+
+        # Checks for gamemodes to play
+        if self.play_FOW:
+            with self.profiler.phase("fog"):
+                self.update_fog(alpha)
+                self.fog.draw(surface)
+
+        return None
+
+    def render_view(self, surface, alpha, camera):
+        """Draws the part of the level inside camera on surface. The background is drawn from the
+        chunks in view, and the moving objects in view are found by a query on the space of
+        pymunk, whose spatial index knows where they are, so nothing outside of the screen is visited"""
+        if self.background_chunks is None:
+            self.background_chunks = viewport.BackgroundChunks(self.current_map, self.bases_list)
+
+        view = camera.rect
+        self.background_chunks.draw(surface, view)
+
+        boxes, tanks, bullets = [], [], []
+        for shape in self.space.bb_query(camera.physics_bb(), pymunk.ShapeFilter()):
+            obj = getattr(shape, "parent", None)
+            if isinstance(obj, gameobjects.Tank):
+                tanks.append(obj)
+            elif isinstance(obj, gameobjects.Bullet):
+                bullets.append(obj)
+            elif isinstance(obj, gameobjects.Box) and obj.body.body_type != pymunk.Body.STATIC:
+                boxes.append(obj)
+        # Drawn in the order of render(): the flag under the boxes, the boxes in the order they were
+        # created (column by column) and the tanks overlapping each other the same way from frame to frame
+        boxes.sort(key=lambda box: (box.x, box.y))
+        tanks.sort(key=self.tanks.index)
+
+        dx, dy = camera.offset()
+        for obj in [self.flag] + boxes + tanks + bullets + self.explosion_list:
+            sprite, rect = obj.screen_sprite(alpha)
+            if rect.colliderect(view):
+                surface.blit(sprite, rect.move(dx, dy))
+        # Like with full redraws, explosions are removed once they have been displayed
+        self.explosion_list.clear()
+
+        if self.play_FOW:
+            with self.profiler.phase("fog"):
+                self.update_fog(alpha, surface.get_size(), (dx, dy))
+                self.fog.draw(surface)
+
+        return None
+
+    def update_fog(self, alpha=1.0, size=None, offset=(0, 0)):
+        """Moves the holes of the fog of war to the tanks of the human players. The fog covers
+        size pixels (the whole level by default), offset is added to the positions of the tanks"""
+        if self.fog is None:
+            self.fog = fog.FogOfWar(size or self.current_map.rect().size)
+
+        lights = {}
+        for tank in self.tanks_list:
+            number = self.tank_number(tank)
+            if number is not None and number < self.human_players:
+                x, y = tank.screen_position(alpha)
+                lights[number] = (x + offset[0], y + offset[1])
+        self.fog.update(lights)
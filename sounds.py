@@ -0,0 +1,67 @@
+""" Sound assets for the game
+"""
+
+import pygame
+import os
+
+main_dir = os.path.split(os.path.abspath(__file__))[0]
+
+# Name and file (in the 'data' folder) of every sound of the game
+SOUNDS = {
+    "explosion": "explosionsound.wav",
+}
+
+
+class AudioBank:
+    """ Loads every sound once and plays them through a fixed pool of mixer channels. """
+
+    def __init__(self, sounds, channels=8, merge_time=40):
+        """ Takes a dictionary of sound names to files, the number of mixer channels in the
+            pool and the time in milliseconds during which new starts of the same sound are
+            merged with the one already playing. """
+        pygame.mixer.set_num_channels(channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(channels)]
+        self.sounds = {name: pygame.mixer.Sound(os.path.join(main_dir, 'data', file)) for name, file in sounds.items()}
+        self.merge_time = merge_time
+        self.last_started = {}
+        self.merged = 0    # Number of sounds merged with an identical sound that had just started
+        self.dropped = 0   # Number of sounds not played because every channel was busy
+
+    def play(self, name):
+        """ Plays a sound on a free channel of the pool. Returns the channel, or None when
+            the sound was merged or every channel was busy. """
+        now = pygame.time.get_ticks()
+        last_started = self.last_started.get(name)
+        if last_started is not None and now - last_started < self.merge_time:
+            self.merged += 1
+            return None
+
+        for channel in self.channels:
+            if not channel.get_busy():
+                channel.play(self.sounds[name])
+                self.last_started[name] = now
+                return channel
+
+        self.dropped += 1
+        return None
+
+
+class NullAudio:
+    """ Has the same interface as AudioBank but plays nothing, for headless runs and machines without sound. """
+
+    def play(self, name):
+        return None
+
+
+def load_audio(headless=False):
+    """ Returns an AudioBank with the sounds of the game, or a NullAudio in headless mode
+        or when the mixer could not be initialised. """
+    if headless:
+        return NullAudio()
+
+    try:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        return AudioBank(SOUNDS)
+    except pygame.error:
+        return NullAudio()
@@ -0,0 +1,34 @@
+""" Spatial queries on the physics space that are shared between the Ai of a session.
+"""
+import pymunk
+
+
+class QueryCache:
+    """ Remembers the results of segment queries on a pymunk space until the space is stepped
+        again. The same query, from the same tank in the same pose, is then only sent to pymunk
+        once per tick. It has the segment_query_first() method of pymunk.Space, so it can be
+        used in place of the space. """
+
+    def __init__(self, space):
+        """ Takes the pymunk space to query. """
+        self.space = space
+        self.results = {}
+        self.hits = 0      # Number of queries answered from the cache
+        self.misses = 0    # Number of queries sent to the space
+
+    def segment_query_first(self, start, end, radius=0, shape_filter=pymunk.ShapeFilter()):
+        """ Returns the first shape hit by the segment between start and end, like
+            pymunk.Space.segment_query_first(). """
+        key = (tuple(start), tuple(end), radius, shape_filter)
+        if key in self.results:
+            self.hits += 1
+            return self.results[key]
+
+        self.misses += 1
+        result = self.space.segment_query_first(start, end, radius, shape_filter)
+        self.results[key] = result
+        return result
+
+    def invalidate(self):
+        """ Call this after every step of the space, the shapes have moved since the results were stored. """
+        self.results.clear()
@@ -0,0 +1,155 @@
+""" Runs many headless AI-vs-AI matches in parallel and summarises their results.
+"""
+import math
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from multiprocessing import Pool
+
+import headless
+
+
+MAP_NAMES = ["map0", "map1", "map2"]
+
+# Parts of a result that depend on the machine and not on the match
+TIMINGS = ("seconds",)
+
+# Largest turn, in degrees, given to a tank at the start of a match (see vary_start)
+START_TURN = 10
+
+
+def vary_start(session, seed):
+    """ The Ai have no randomness of their own, so every match on a map would be the same match.
+        Every tank of session starts turned by up to START_TURN degrees and able to shoot after a
+        different number of ticks instead, the same seed always giving the same start. """
+    rng = random.Random(seed)
+    for tank in session.tanks:
+        tank.frames_since_last_shoot = rng.randrange(session.reload_ticks + 1)
+        tank.body.angle += math.radians(rng.uniform(-START_TURN, START_TURN))
+
+
+def play_match(match):
+    """ Plays one headless match and returns its result as a dictionary """
+    map_name, number, max_ticks, seed = match
+
+    # The game modules load their images on import, so they can only be imported once the worker is set up (see
+    # headless.init(), run once per worker process)
+    import maps
+    from session import GameSession
+
+    # Every match gets a new session: pymunk keeps state of its own between steps (cached contacts,
+    # the order of the shapes) that a played session cannot be put back in, so a match played on
+    # a reused session would depend on the matches the worker played before it
+    session = GameSession(maps.find(map_name), human_players=0, headless=True)
+    vary_start(session, seed)
+    elapsed = session.run(max_ticks)
+
+    captures = [0] * len(session.kills)
+    if session.winner is not None:
+        captures[session.winner] = 1
+
+    return {"map": map_name,
+            "match": number,
+            "seed": seed,
+            "winner": session.winner,
+            "ticks": session.ticks,
+            "seconds": elapsed,
+            "captures": captures,
+            "kills": list(session.kills),
+            "flag_pickups": list(session.flag_pickups)}
+
+
+def differences(results, again):
+    """ Returns the matches whose two results differ in anything but their timings, as "map match" strings. """
+    def outcome(result):
+        return {key: value for key, value in result.items() if key not in TIMINGS}
+    first = {(result["map"], result["match"]): outcome(result) for result in results}
+    return ["%s %d" % (result["map"], result["match"]) for result in again
+            if first[(result["map"], result["match"])] != outcome(result)]
+
+
+def print_table(title, header, rows):
+    """ Prints rows as a plain text table with right aligned columns """
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    print()
+    print(title)
+    print("  ".join(str(cell).rjust(width) for cell, width in zip(header, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def summarise(results):
+    """ Prints one table per map and one per tank number combining all match results """
+    by_map = defaultdict(list)
+    for result in results:
+        by_map[result["map"]].append(result)
+
+    rows = []
+    for map_name in sorted(by_map):
+        matches = by_map[map_name]
+        decided = [m for m in matches if m["winner"] is not None]
+        ticks = sum(m["ticks"] for m in matches)
+        seconds = sum(m["seconds"] for m in matches)
+        rows.append([map_name, len(matches), len(decided), len(matches) - len(decided),
+                     "%.0f" % (ticks / len(matches)), "%.0f" % (ticks / max(seconds, 1e-9))])
+    print_table("Matches per map", ["map", "matches", "won", "no winner", "avg ticks", "ticks/sec"], rows)
+
+    for map_name in sorted(by_map):
+        matches = by_map[map_name]
+        rows = []
+        for tank in range(len(matches[0]["kills"])):
+            rows.append([tank,
+                         sum(m["captures"][tank] for m in matches),
+                         sum(m["kills"][tank] for m in matches),
+                         sum(m["flag_pickups"][tank] for m in matches)])
+        print_table("Tanks on %s" % map_name, ["tank", "captures", "kills", "flag pickups"], rows)
+
+
+def main():
+    arg_parser = ArgumentParser(description="Runs AI-vs-AI matches over the bundled maps on a process pool")
+    arg_parser.add_argument("--matches", type=int, default=10, help="number of matches per map")
+    arg_parser.add_argument("--maps", nargs="+", default=MAP_NAMES,
+                            help="maps to play on: map0, map1, map2, maps of data/maps or paths of map files")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    arg_parser.add_argument("--max-ticks", type=int, default=20000, help="tick limit of a match without winner")
+    arg_parser.add_argument("--seed", type=int, default=0,
+                            help="seed of the first match on every map, the next matches take the next seeds")
+    arg_parser.add_argument("--check", action="store_true",
+                            help="play every match a second time, in the opposite order, and fail if a result differs")
+    args = arg_parser.parse_args()
+
+    matches = [(map_name, number, args.max_ticks, args.seed + number)
+               for map_name in args.maps for number in range(args.matches)]
+    results = []
+    start_time = time.perf_counter()
+
+    with Pool(args.workers, initializer=headless.init) as pool:
+        for result in pool.imap_unordered(play_match, matches):
+            results.append(result)
+            outcome = "no winner" if result["winner"] is None else "tank %d won" % result["winner"]
+            print("[%d/%d] %s match %d (seed %d): %s after %d ticks" % (len(results), len(matches), result["map"],
+                                                                       result["match"], result["seed"], outcome,
+                                                                       result["ticks"]))
+
+    summarise(results)
+    print()
+    print("%d matches in %.1f s on %d workers" % (len(results), time.perf_counter() - start_time, args.workers))
+
+    if args.check:
+        # In the opposite order the matches are played by other workers, after other matches,
+        # which must not change their outcome
+        with Pool(args.workers, initializer=headless.init) as pool:
+            again = pool.map(play_match, matches[::-1])
+        mismatches = differences(results, again)
+        if mismatches:
+            print("different results when played again: %s" % ", ".join(mismatches), file=sys.stderr)
+            sys.exit(1)
+        print("every match gave the same result when played again")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+""" Camera over levels larger than the window: only the part of the level inside the camera is drawn.
+"""
+from collections import OrderedDict
+
+import pygame
+import pymunk
+
+import images
+import renderer
+
+
+class Camera:
+    """ The rectangle of the level, in pixels, that is shown on the screen. It follows a target
+        (any object with screen_position(), for instance a tank) or, without target, moves
+        freely for spectators. It never leaves the level. """
+
+    SCROLL_SPEED = 600  # Pixels per second when moving freely
+
+    def __init__(self, size, world):
+        """ Takes the size of the screen and the rectangle of the level, in pixels. """
+        self.rect = pygame.Rect((0, 0), size)
+        self.world = world
+        self.target = None
+        self.scrolling = (0, 0)  # Direction of the free movement, -1, 0 or 1 on every axis
+        self.rect.center = world.center
+        self.rect.clamp_ip(world)
+
+    def follow(self, target):
+        """ Keeps target in the middle of the screen, None to move freely. """
+        self.target = target
+
+    def scroll(self, dx, dy):
+        """ Starts (-1 or 1) or stops (0) moving freely along each axis. """
+        self.scrolling = (dx, dy)
+
+    def update(self, elapsed, alpha=1.0):
+        """ Moves the camera for a frame of elapsed seconds, alpha is passed on to the target. """
+        if self.target is not None:
+            x, y = self.target.screen_position(alpha)
+            self.rect.center = (int(x), int(y))
+        else:
+            self.rect.move_ip(round(self.scrolling[0] * self.SCROLL_SPEED * elapsed),
+                              round(self.scrolling[1] * self.SCROLL_SPEED * elapsed))
+        self.rect.clamp_ip(self.world)
+
+    def offset(self):
+        """ Returns what to add to a position in the level to get its position on the screen. """
+        return -self.rect.x, -self.rect.y
+
+    def physics_bb(self, margin=1):
+        """ Returns the area seen by the camera in the units of the physics engine (tiles),
+            grown by margin tiles for the sprites larger than their shapes. """
+        return pymunk.BB(self.rect.left / images.TILE_SIZE - margin, self.rect.top / images.TILE_SIZE - margin,
+                         self.rect.right / images.TILE_SIZE + margin, self.rect.bottom / images.TILE_SIZE + margin)
+
+
+class BackgroundChunks:
+    """ The background of a large level, split in square chunks that are drawn the first time
+        they are seen. Only the chunks around the camera are kept, the least recently seen
+        ones are dropped and drawn again if they come back into view. """
+
+    def __init__(self, current_map, objects, chunk_tiles=16, max_chunks=64):
+        """ Takes the map, whose grass and rock boxes are drawn, the objects drawn over them
+            (the bases), the size of a chunk in tiles and the number of chunks kept. """
+        self.current_map = current_map
+        self.level = current_map.rect()
+        self.chunk_size = chunk_tiles * images.TILE_SIZE
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()   # (column, row) -> surface
+        self.drawn = 0                # Number of chunks drawn, for profiling
+
+        # The objects are sorted into every chunk they overlap once, they never move
+        self.objects = {}
+        for obj in objects:
+            for key in self.keys(obj.screen_sprite()[1]):
+                self.objects.setdefault(key, []).append(obj)
+
+    def keys(self, rect):
+        """ Returns the (column, row) of every chunk overlapping rect. """
+        rect = rect.clip(self.level)
+        return [(column, row)
+                for column in range(rect.left // self.chunk_size, (rect.right - 1) // self.chunk_size + 1)
+                for row in range(rect.top // self.chunk_size, (rect.bottom - 1) // self.chunk_size + 1)]
+
+    def chunk(self, key):
+        """ Returns the surface of the chunk at key, drawing it if it is not kept. """
+        surface = self.chunks.get(key)
+        if surface is not None:
+            self.chunks.move_to_end(key)
+            return surface
+
+        area = pygame.Rect(key[0] * self.chunk_size, key[1] * self.chunk_size,
+                           self.chunk_size, self.chunk_size).clip(self.level)
+        surface = pygame.Surface(area.size)
+        renderer.draw_tiles(surface, self.current_map, area)
+        for obj in self.objects.get(key, ()):
+            sprite, rect = obj.screen_sprite()
+            surface.blit(sprite, rect.move(-area.x, -area.y))
+
+        self.drawn += 1
+        self.chunks[key] = surface
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return surface
+
+    def draw(self, screen, view):
+        """ Draws the part of the background inside view (a rectangle of the level) on screen. """
+        for key in self.keys(view):
+            screen.blit(self.chunk(key), (key[0] * self.chunk_size - view.x, key[1] * self.chunk_size - view.y))